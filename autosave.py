@@ -0,0 +1,76 @@
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+from PyQt5.QtCore import QObject, QTimer
+
+from file_watcher import file_signature
+from metrics import metrics
+from outline_index import write_indexed_outline
+
+AUTOSAVE_DELAY_MS = int(os.environ.get("EXPANSION_AUTOSAVE_DELAY_MS", "1500"))
+
+
+class Autosaver(QObject):
+    # Edits only mark the document dirty and restart the debounce timer. When
+    # it fires, an immutable snapshot of the tree is taken on the GUI thread
+    # and serialized by a single background writer, so saves stay ordered.
+    # `saved` is the document the file was last read from or written with,
+    # and `signature` the file's (mtime, size) after our last write.
+    def __init__(self, filename: str, snapshot: Callable[[], Any],
+                 delay_ms: int = AUTOSAVE_DELAY_MS, parent=None):
+        super().__init__(parent)
+        self.filename = filename
+        self.snapshot = snapshot
+        self.dirty = False
+        self.saved: Any = None
+        self.signature: Optional[Tuple[int, int]] = None
+        self.pending: Optional[Future] = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay_ms)
+        self.timer.timeout.connect(self.save_now)
+
+    def mark_dirty(self):
+        self.dirty = True
+        self.timer.start()
+
+    def mark_saved(self, document):
+        self.saved = document
+        self.signature = file_signature(self.filename)
+
+    def save_now(self):
+        self.timer.stop()
+        if not self.dirty:
+            return
+        document = self.snapshot()
+        self.saved = document
+        self.dirty = False
+        self.pending = self.executor.submit(self.write, document)
+
+    def write(self, document):
+        start = time.perf_counter()
+        try:
+            size = write_indexed_outline(document, self.filename)
+        except OSError as e:
+            self.dirty = True
+            print(f"Autosave to {self.filename} failed: {e}")
+            return
+        self.signature = file_signature(self.filename)
+        metrics.record_io('save', time.perf_counter() - start, size, self.filename)
+        print(f"Autosaved {size} bytes to: {self.filename}")
+
+    def wait(self):
+        if self.pending:
+            self.pending.result()
+            self.pending = None
+
+    def flush(self):
+        self.save_now()
+        self.wait()
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown(wait=True)
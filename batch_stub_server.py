@@ -0,0 +1,124 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from evaluation import EVALUATION_CRITERIA
+
+BATCHES_PATH = '/v1/messages/batches'
+
+
+def stub_evaluation(score: int = 4) -> Dict[str, Any]:
+    return {criterion: {"score": score, "comment": "Stub evaluation."} for criterion in EVALUATION_CRITERIA}
+
+
+def stub_message(text: str) -> Dict[str, Any]:
+    return {
+        "id": "msg_stub", "type": "message", "role": "assistant", "model": "stub",
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn", "stop_sequence": None,
+        "usage": {"input_tokens": 10, "output_tokens": 10}
+    }
+
+
+class BatchStubServer:
+    # Local stand-in for the Message Batches endpoints (create, retrieve and
+    # results) for trying batch mode without the API: point
+    # ANTHROPIC_BASE_URL at `url`. A batch ends after `polls_until_ended`
+    # retrieves and every request succeeds with `evaluation`. Unknown batch
+    # IDs get the API's 404 error body.
+    def __init__(self, evaluation: Optional[Dict[str, Any]] = None, polls_until_ended: int = 2,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.evaluation = evaluation or stub_evaluation()
+        self.polls_until_ended = polls_until_ended
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.created: List[str] = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format: str, *args: Any):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('content-length', 0))) or b'{}')
+                if self.path.split('?')[0].rstrip('/') != BATCHES_PATH:
+                    return self.send_error_body(404, 'not_found_error', f"No route for {self.path}")
+                self.send_json(server.create(body.get('requests', [])))
+
+            def do_GET(self):
+                parts = self.path.split('?')[0][len(BATCHES_PATH):].strip('/').split('/')
+                batch_id = parts[0]
+                if not self.path.startswith(BATCHES_PATH) or batch_id not in server.batches:
+                    return self.send_error_body(404, 'not_found_error', f"Batch {batch_id} not found")
+                if parts[1:] == ['results']:
+                    lines = "".join(json.dumps(result) + "\n" for result in server.results(batch_id))
+                    return self.send_body(lines.encode('utf-8'), 'application/x-jsonl')
+                self.send_json(server.retrieve(batch_id))
+
+            def send_json(self, data: Dict[str, Any], status: int = 200):
+                self.send_body(json.dumps(data).encode('utf-8'), 'application/json', status)
+
+            def send_error_body(self, status: int, error_type: str, message: str):
+                self.send_json({"type": "error", "error": {"type": error_type, "message": message}}, status)
+
+            def send_body(self, data: bytes, content_type: str, status: int = 200):
+                self.send_response(status)
+                self.send_header('content-type', content_type)
+                self.send_header('content-length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self.thread: Optional[threading.Thread] = None
+
+    def create(self, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+        with self.lock:
+            batch_id = f"msgbatch_stub_{len(self.created) + 1}"
+            self.created.append(batch_id)
+            self.batches[batch_id] = {'custom_ids': [request['custom_id'] for request in requests], 'polls': 0}
+        return self.batch_object(batch_id)
+
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        with self.lock:
+            self.batches[batch_id]['polls'] += 1
+        return self.batch_object(batch_id)
+
+    def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        text = json.dumps(self.evaluation)
+        return [
+            {"custom_id": custom_id, "result": {"type": "succeeded", "message": stub_message(text)}}
+            for custom_id in self.batches[batch_id]['custom_ids']
+        ]
+
+    def batch_object(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.batches[batch_id]
+        count = len(batch['custom_ids'])
+        ended = batch['polls'] >= self.polls_until_ended
+        return {
+            "id": batch_id, "type": "message_batch",
+            "processing_status": 'ended' if ended else 'in_progress',
+            "request_counts": {"processing": 0 if ended else count, "succeeded": count if ended else 0,
+                               "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": "2024-01-01T00:00:00Z", "expires_at": "2024-01-02T00:00:00Z",
+            "ended_at": "2024-01-01T00:01:00Z" if ended else None,
+            "cancel_initiated_at": None, "archived_at": None,
+            "results_url": f"{self.url}{BATCHES_PATH}/{batch_id}/results" if ended else None
+        }
+
+    def start(self) -> 'BatchStubServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    stub = BatchStubServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+    print(f"Batch stub listening; set ANTHROPIC_BASE_URL={stub.url}")
+    stub.httpd.serve_forever()
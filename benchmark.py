@@ -0,0 +1,275 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+CRITERIA = ["Dialogue", "Hooks_and_Transitions", "Theme_Subtext", "Prose_Quality", "Relevance_to_Overall_Story"]
+WORDS = ("the night was long and the river ran cold under the bridge while she waited for "
+         "an answer that never came so he turned back toward the lights of town").split()
+
+
+def random_evaluation(rng: random.Random) -> Dict[str, Any]:
+    return {criterion: {"score": rng.randint(1, 5), "comment": "Synthetic comment."} for criterion in CRITERIA}
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    text = " ".join(words)
+    return "\n\n".join(text[i:i + 400] for i in range(0, len(text), 400))
+
+
+def generate_outline(depth: int, fan_out: int, scene_length: int, evaluation_density: float,
+                     seed: int = 0) -> Iterator[str]:
+    # Every leaf sits at level `depth` and carries `scene_length` characters;
+    # a share of leaves given by `evaluation_density` is already evaluated.
+    rng = random.Random(seed)
+    stack = [(1, 0)]
+    yield "[LEVEL 1]Synthetic Story\nA generated outline.\n"
+    while stack:
+        level, emitted = stack[-1]
+        if level == depth or emitted == fan_out:
+            stack.pop()
+            yield f"[/LEVEL {level}]\n"
+            continue
+        stack[-1] = (level, emitted + 1)
+        child_level = level + 1
+        if child_level == depth:
+            yield f"[LEVEL {child_level}]Scene {emitted + 1}\n{random_text(rng, scene_length)}\n"
+            if rng.random() < evaluation_density:
+                yield f"[EVALUATION]{json.dumps(random_evaluation(rng))}\n"
+        else:
+            yield f"[LEVEL {child_level}]Part {emitted + 1}\nSummary of part {emitted + 1}.\n"
+        stack.append((child_level, 0))
+
+
+class FakeContent:
+    def __init__(self, text: str):
+        self.type = "text"
+        self.text = text
+
+
+class FakeUsage:
+    def __init__(self, input_tokens: int, output_tokens: int):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cache_creation_input_tokens = 0
+        self.cache_read_input_tokens = 0
+
+
+class FakeMessage:
+    def __init__(self, text: str, input_tokens: int):
+        self.content = [FakeContent(text)]
+        self.usage = FakeUsage(input_tokens, len(text) // 4)
+
+
+class FakeStream:
+    def __init__(self, message: FakeMessage, chunk_size: int = 16):
+        self.message = message
+        text = message.content[0].text
+        self.text_stream = (text[i:i + chunk_size] for i in range(0, len(text), chunk_size))
+
+    def __enter__(self) -> 'FakeStream':
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def get_final_message(self) -> FakeMessage:
+        return self.message
+
+
+class FakeMessages:
+    def __init__(self, latency: float, error_rate: float, seed: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def create(self, **params) -> FakeMessage:
+        with self.lock:
+            self.calls += 1
+            failed = self.rng.random() < self.error_rate
+            evaluation = random_evaluation(self.rng)
+        time.sleep(self.latency)
+        if failed:
+            raise RuntimeError("Synthetic API error")
+        input_tokens = len(json.dumps(params)) // 4
+        return FakeMessage(json.dumps(evaluation), input_tokens)
+
+    def stream(self, **params) -> FakeStream:
+        return FakeStream(self.create(**params))
+
+
+class FakeClient:
+    # Stands in for the anthropic client with a fixed latency per call and a
+    # configurable share of calls that raise.
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, seed: int = 0):
+        self.messages = FakeMessages(latency, error_rate, seed)
+
+
+def time_call(function: Callable[[], Any], setup: Optional[Callable[[], Any]] = None,
+              repeat: int = 3) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args: argparse.Namespace) -> Iterator[Dict[str, Any]]:
+    from PyQt5.QtWidgets import QApplication
+
+    import evaluation
+    import expansions
+    from scheduler import RequestScheduler
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    fake_client = FakeClient(args.latency, args.error_rate, args.seed)
+    evaluation.client = fake_client
+    expansions.EVALUATION_CONCURRENCY = args.concurrency
+    revision = git_revision()
+    working_directory = os.getcwd()
+
+    for fan_out in args.fan_out:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            with open('synthetic.txt', 'w', encoding='utf-8') as file:
+                file.writelines(generate_outline(
+                    args.depth, fan_out, args.scene_length, args.evaluation_density, args.seed
+                ))
+            shutil.copyfile('synthetic.txt', 'outline.txt')
+            outline_bytes = os.path.getsize('outline.txt')
+
+            def reload():
+                shutil.copyfile('synthetic.txt', 'outline.txt')
+                editor.load_file('outline.txt')
+
+            editor = expansions.ExpansionEditor()
+            editor.evaluator.cache = None
+            editor.evaluator.scheduler = RequestScheduler(
+                evaluation.send_request, args.rpm, args.tpm, args.concurrency
+            )
+            root = editor.model.root
+            nodes = sum(1 for _ in root.iter_nodes())
+            scenes = len(evaluation.collect_scene_jobs(root))
+            params = {
+                'depth': args.depth, 'fan_out': fan_out, 'scene_length': args.scene_length,
+                'evaluation_density': args.evaluation_density, 'nodes': nodes, 'scenes': scenes,
+                'outline_bytes': outline_bytes
+            }
+
+            def record(name: str, samples: List[float], **extra) -> Dict[str, Any]:
+                result = {
+                    'benchmark': name, 'seconds': statistics.median(samples), 'samples': samples,
+                    'revision': revision, 'python': platform.python_version()
+                }
+                result.update(params)
+                result.update(extra)
+                return result
+
+            yield record('load_file', time_call(lambda: editor.load_file('outline.txt'), repeat=args.repeat))
+
+            root = editor.model.root
+            yield record('generate_content', time_call(lambda: editor.generate_content(root), repeat=args.repeat))
+
+            subtree = root.children[0].children[1]
+
+            def demote_promote():
+                editor.select_node(subtree)
+                editor.demote_node()
+                editor.promote_node()
+
+            yield record('demote_promote', time_call(demote_promote, repeat=args.repeat))
+
+            yield record('undo_redo', time_call(
+                lambda: (editor.undo(), editor.redo()), repeat=args.repeat
+            ))
+
+            yield record('clear_all_evaluations', time_call(
+                editor.clear_all_evaluations, setup=reload, repeat=args.repeat
+            ))
+
+            def evaluate_all():
+                editor.evaluate_all_scenes()
+                while editor.evaluation_runner:
+                    app.processEvents()
+                    time.sleep(0.001)
+
+            calls_before = fake_client.messages.calls
+            samples = time_call(evaluate_all, repeat=1)
+            yield record('evaluate_all', samples, concurrency=args.concurrency, latency=args.latency,
+                         error_rate=args.error_rate, rpm=args.rpm, tpm=args.tpm, api_calls=fake_client.messages.calls - calls_before)
+
+            editor.autosaver.close()
+            editor.deleteLater()
+            app.processEvents()
+            os.chdir(working_directory)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Benchmark the outline editor on synthetic outlines.')
+    parser.add_argument('--depth', type=int, default=5, help='Level of the leaf scenes.')
+    parser.add_argument('--fan-out', type=int, nargs='+', default=[3, 5, 7],
+                        help='Children per node; one benchmark round per value.')
+    parser.add_argument('--scene-length', type=int, default=2000, help='Characters per scene.')
+    parser.add_argument('--evaluation-density', type=float, default=0.5,
+                        help='Share of scenes that start with an evaluation.')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per fake API call.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of fake API calls that fail.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Evaluate All worker count.')
+    parser.add_argument('--rpm', type=float, default=0, help='Scheduler requests-per-minute budget.')
+    parser.add_argument('--tpm', type=float, default=0, help='Scheduler tokens-per-minute budget.')
+    parser.add_argument('--repeat', type=int, default=3, help='Samples per benchmark.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Append JSON lines here instead of printing them.')
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    output = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+    try:
+        # The editor reports progress with print(); keep stdout for results.
+        with contextlib.redirect_stdout(sys.stderr):
+            for result in run_benchmarks(args):
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
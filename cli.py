@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from typing import List, Optional
+
+from evaluation import (
+    CACHE_KEY_STORY_CONTEXT, CHUNK_OVERLAP, CHUNK_SIZE, CHUNK_THRESHOLD, ESCALATION_BAND, ESCALATION_MIN_CRITERIA,
+    EVALUATION_CACHE_FILE, EVALUATION_CONCURRENCY, EVALUATION_MODELS, SceneEvaluator, build_story_outline,
+    collect_scene_jobs, evaluate_scenes, parse_band, send_request
+)
+from exporter import EXPORT_FORMATS, iter_export_chunks
+from message_batches import BatchEvaluator
+from metrics import metrics
+from outline_parser import parse_file
+from outline_index import OutlineIndex, write_indexed_outline
+from outline_writer import write_atomic
+from scheduler import RATE_LIMIT_RPM, RATE_LIMIT_TPM, RequestScheduler
+
+
+def command_evaluate(args: argparse.Namespace) -> int:
+    start = time.perf_counter()
+    root = parse_file(args.outline)
+    metrics.record_io('load', time.perf_counter() - start, os.path.getsize(args.outline), args.outline)
+    jobs = collect_scene_jobs(root)
+    evaluator = SceneEvaluator(cache_file=None if args.no_cache else EVALUATION_CACHE_FILE,
+                               concurrency=args.concurrency, chunked=args.chunked,
+                               chunk_threshold=args.chunk_threshold, chunk_size=args.chunk_size,
+                               chunk_overlap=args.chunk_overlap, models=args.models,
+                               escalation_band=args.escalation_band,
+                               escalation_min_criteria=args.escalation_min_criteria,
+                               key_story_context=args.key_story_context)
+    evaluator.scheduler = RequestScheduler(send_request, args.rpm, args.tpm, args.concurrency)
+    evaluator.story_context = build_story_outline(root)
+    if args.batch:
+        print(f"Evaluating {len(jobs)} scenes through the Message Batches API...")
+    else:
+        print(f"Evaluating {len(jobs)} scenes with concurrency {args.concurrency}...")
+
+    cancelled = threading.Event()
+    if args.batch:
+        results = BatchEvaluator(evaluator).evaluate_jobs(jobs, cancelled)
+    else:
+        results = evaluate_scenes(jobs, evaluator.evaluate, args.concurrency, cancelled)
+    jsonl_file = open(args.jsonl, 'w', encoding='utf-8') if args.jsonl else None
+    completed = 0
+    failures = 0
+    try:
+        for node, result, error in results:
+            if error is None and "error" in result:
+                error = result['error']['comment']
+            if error is None:
+                node.evaluation = result
+                completed += 1
+                print(f"Evaluation completed for {node.title}")
+            else:
+                failures += 1
+                print(f"Evaluation error for {node.title}: {error}", file=sys.stderr)
+
+            if jsonl_file:
+                record = {
+                    "path": "/".join(str(index) for index in node.path()),
+                    "title": node.title,
+                    "evaluation": None if error else result,
+                    "error": error
+                }
+                jsonl_file.write(json.dumps(record) + "\n")
+                jsonl_file.flush()
+    except KeyboardInterrupt:
+        cancelled.set()
+        results.close()
+        print("Evaluation cancelled.", file=sys.stderr)
+        return 130
+    finally:
+        if jsonl_file:
+            jsonl_file.close()
+
+    if args.output or not args.jsonl:
+        output = args.output or args.outline
+        start = time.perf_counter()
+        size = write_indexed_outline(root, output)
+        metrics.record_io('save', time.perf_counter() - start, size, output)
+        print(f"Saved to: {output}")
+
+    metrics.write_prometheus()
+    print(f"Evaluated {completed} scenes, {failures} failed.")
+    return 1 if failures else 0
+
+
+def command_export(args: argparse.Namespace) -> int:
+    chunks = iter_export_chunks(args.outline, args.format, args.evaluations, args.below)
+    start = time.perf_counter()
+    if args.output:
+        size = write_atomic([args.output], chunks)
+        metrics.record_io('export', time.perf_counter() - start, size, args.output)
+        print(f"Exported {args.outline} to {args.output} ({size} bytes)")
+    else:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+        sys.stdout.flush()
+    return 0
+
+
+def command_node(args: argparse.Namespace) -> int:
+    index = OutlineIndex(args.outline)
+    try:
+        title, content, evaluation = index.read_node(args.path)
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        return 2
+    if args.evaluate:
+        evaluator = SceneEvaluator(cache_file=None if args.no_cache else EVALUATION_CACHE_FILE)
+        evaluator.story_context = build_story_outline(index.outline_titles())
+        evaluation = evaluator.evaluate(content)
+        if "error" in evaluation:
+            print(f"Evaluation error for {title}: {evaluation['error']['comment']}", file=sys.stderr)
+            return 1
+        index.patch_evaluation(args.path, evaluation)
+        print(f"Evaluation completed for {title}", file=sys.stderr)
+    print(json.dumps({"path": args.path, "title": title, "content": content, "evaluation": evaluation}))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='expansions', description='Headless tools for expansion outlines.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    evaluate = subparsers.add_parser('evaluate', help='Evaluate every qualifying level 5/6 scene.')
+    evaluate.add_argument('outline', help='Outline file to evaluate.')
+    evaluate.add_argument('--concurrency', type=int, default=EVALUATION_CONCURRENCY,
+                          help='Number of scenes evaluated in parallel.')
+    evaluate.add_argument('--rpm', type=float, default=RATE_LIMIT_RPM,
+                          help='Requests-per-minute budget; 0 disables the limit.')
+    evaluate.add_argument('--tpm', type=float, default=RATE_LIMIT_TPM,
+                          help='Input tokens-per-minute budget; 0 disables the limit.')
+    evaluate.add_argument('--output',
+                          help='Write the evaluated outline here (defaults to the input file '
+                               'unless only --jsonl is given).')
+    evaluate.add_argument('--jsonl', help='Write one JSON result per scene to this file.')
+    mode = evaluate.add_mutually_exclusive_group()
+    mode.add_argument('--batch', action='store_true',
+                      help='Submit all scenes as one Message Batch and poll for the results; '
+                           'an interrupted batch is resumed on the next run.')
+    mode.add_argument('--chunked', action='store_true',
+                      help='Split long scenes into overlapping excerpts evaluated in parallel.')
+    evaluate.add_argument('--chunk-threshold', type=int, default=CHUNK_THRESHOLD,
+                          help='Scenes longer than this many characters are chunked.')
+    evaluate.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                          help='Target excerpt length in characters.')
+    evaluate.add_argument('--chunk-overlap', type=int, default=CHUNK_OVERLAP,
+                          help='Characters of trailing paragraphs repeated at the start of the next excerpt.')
+    evaluate.add_argument('--models', type=lambda text: [model.strip() for model in text.split(',') if model.strip()],
+                          default=EVALUATION_MODELS,
+                          help='Comma-separated model cascade, cheapest first (default: %(default)s).')
+    evaluate.add_argument('--escalation-band', type=parse_band, default=ESCALATION_BAND,
+                          help='Score range such as 2-3 that counts as borderline.')
+    evaluate.add_argument('--escalation-min-criteria', type=int, default=ESCALATION_MIN_CRITERIA,
+                          help='Borderline criteria needed to pass a scene to the next model (default: %(default)s).')
+    evaluate.add_argument('--no-cache', action='store_true', help='Bypass the on-disk evaluation cache.')
+    evaluate.add_argument('--key-story-context', action='store_true', default=CACHE_KEY_STORY_CONTEXT,
+                          help='Include the story outline in cache keys, so any title change '
+                               're-evaluates every scene.')
+    evaluate.set_defaults(handler=command_evaluate)
+
+    node = subparsers.add_parser('node', help='Print one node as JSON through the sidecar index.')
+    node.add_argument('outline', help='Outline file to read.')
+    node.add_argument('path', help='Node path such as 0/3/2, as written to --jsonl.')
+    node.add_argument('--evaluate', action='store_true',
+                      help='Evaluate the node and write its [EVALUATION] line back in place.')
+    node.add_argument('--no-cache', action='store_true', help='Bypass the on-disk evaluation cache.')
+    node.set_defaults(handler=command_node)
+
+    export = subparsers.add_parser('export', help='Render an outline as a reading copy.')
+    export.add_argument('outline', help='Outline file to export.')
+    export.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='markdown',
+                        help='Output format (default: %(default)s).')
+    export.add_argument('--output', help='Write the export here instead of to standard output.')
+    export.add_argument('--evaluations', action='store_true',
+                        help='Include a summary of each scene\'s evaluation.')
+    export.add_argument('--below', type=float, metavar='SCORE',
+                        help='Only export scenes whose mean evaluation score is below SCORE.')
+    export.set_defaults(handler=command_export)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+import os
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+from outline_parser import OutlineNode
+
+UNDO_LIMIT = int(os.environ.get("EXPANSION_UNDO_LIMIT", "500"))
+
+
+class DocNode:
+    # Immutable snapshot of one outline node. Unchanged subtrees are shared
+    # between successive snapshots, so a snapshot taken after an edit only
+    # allocates the nodes on the path from the root to the change. `node`
+    # is the live OutlineNode the snapshot was taken from.
+    __slots__ = ('title', 'content', 'evaluation', 'children', 'node', '__weakref__')
+
+    def __init__(self, title: str, content: str, evaluation: Optional[Dict[str, Any]],
+                 children: Tuple['DocNode', ...], node: OutlineNode):
+        object.__setattr__(self, 'title', title)
+        object.__setattr__(self, 'content', content)
+        object.__setattr__(self, 'evaluation', evaluation)
+        object.__setattr__(self, 'children', children)
+        object.__setattr__(self, 'node', node)
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError("DocNode is immutable")
+
+    def __repr__(self) -> str:
+        return f"DocNode(title={self.title!r}, children={len(self.children)})"
+
+
+def snapshot(node: OutlineNode) -> DocNode:
+    if node.doc is None:
+        node.doc = DocNode(
+            node.title, node.content, node.evaluation,
+            tuple(snapshot(child) for child in node.children), node
+        )
+    return node.doc
+
+
+def detach(node: OutlineNode, detached: List[OutlineNode]):
+    # Nodes dropped by a restore may hold stale child lists by the time a
+    # redo brings them back, so their snapshots are forgotten.
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        node.doc = None
+        detached.append(node)
+        stack.extend(node.children)
+
+
+def is_attached(node: OutlineNode, root: OutlineNode) -> bool:
+    while node is not root:
+        parent = node.parent
+        if parent is None or node not in parent.children:
+            return False
+        node = parent
+    return True
+
+
+def restore(root: OutlineNode, doc: DocNode) -> Tuple[List[OutlineNode], List[OutlineNode]]:
+    # Brings the live tree back to `doc` in place, reusing the live nodes the
+    # snapshot was taken from and skipping every subtree whose cached
+    # snapshot already is the target. Returns the nodes that were rewritten
+    # and the nodes that are no longer in the tree.
+    restored: List[Tuple[OutlineNode, DocNode]] = []
+    detached: List[OutlineNode] = []
+    stack = [(root, doc)]
+    while stack:
+        node, doc = stack.pop()
+        if node.doc is doc:
+            continue
+        children = [child.node for child in doc.children]
+        kept = set(children)
+        for child in node.children:
+            if child not in kept and child.parent is node:
+                # Unlinked so a dropped node no longer claims a row in its
+                # old parent; a redo that brings it back re-parents it below.
+                detach(child, detached)
+                child.parent = None
+        node.title = doc.title
+        node.content = doc.content
+        node.evaluation = doc.evaluation
+        node.children = children
+        for child, child_doc in zip(children, doc.children):
+            child.parent = node
+            stack.append((child, child_doc))
+        restored.append((node, doc))
+
+    # The setters above cleared cached snapshots; the restored nodes are
+    # now exactly their target snapshots again.
+    for node, doc in restored:
+        node.doc = doc
+    return [node for node, _ in restored], [node for node in detached if not is_attached(node, root)]
+
+
+def align_children(docs: Tuple[DocNode, ...], nodes: List[OutlineNode]
+                   ) -> List[Tuple[Optional[DocNode], Optional[OutlineNode], bool]]:
+    # Pairs the children of a snapshot with the children of another tree in
+    # order, matching by title. Children outside the matched runs that have
+    # the same title and content on both sides were reordered and come back
+    # as moves, (doc, node, True). Inside a replaced run the rest are paired
+    # position by position, so a retitled node is still patched in place;
+    # what is left comes back as (doc, None, False) for removals and
+    # (None, node, False) for insertions, in the order of `nodes`.
+    if len(docs) == len(nodes) and all(doc.title == node.title for doc, node in zip(docs, nodes)):
+        return [(doc, node, False) for doc, node in zip(docs, nodes)]
+    matcher = SequenceMatcher(None, [doc.title for doc in docs], [node.title for node in nodes], autojunk=False)
+    opcodes = matcher.get_opcodes()
+
+    unmatched: Dict[Tuple[str, str], List[DocNode]] = {}
+    for tag, doc_start, doc_end, _, _ in opcodes:
+        if tag != 'equal':
+            for doc in docs[doc_start:doc_end]:
+                unmatched.setdefault((doc.title, doc.content), []).append(doc)
+    moved: Dict[int, DocNode] = {}
+    for tag, _, _, node_start, node_end in opcodes:
+        if tag != 'equal':
+            for row in range(node_start, node_end):
+                candidates = unmatched.get((nodes[row].title, nodes[row].content))
+                if candidates:
+                    moved[row] = candidates.pop(0)
+    taken = {id(doc) for doc in moved.values()}
+
+    pairs: List[Tuple[Optional[DocNode], Optional[OutlineNode], bool]] = []
+    for tag, doc_start, doc_end, node_start, node_end in opcodes:
+        if tag == 'equal':
+            pairs.extend((doc, node, False) for doc, node in zip(docs[doc_start:doc_end], nodes[node_start:node_end]))
+            continue
+        left = [doc for doc in docs[doc_start:doc_end] if id(doc) not in taken]
+        for row in range(node_start, node_end):
+            if row in moved:
+                pairs.append((moved[row], nodes[row], True))
+            elif left and tag == 'replace':
+                pairs.append((left.pop(0), nodes[row], False))
+            else:
+                pairs.append((None, nodes[row], False))
+        pairs.extend((doc, None, False) for doc in left)
+    return pairs
+
+
+class History:
+    # Undo and redo stacks of whole-document snapshots. Because snapshots
+    # share unchanged subtrees, each entry costs memory proportional to the
+    # path its edit touched rather than to the manuscript.
+    def __init__(self, limit: int = UNDO_LIMIT):
+        self.limit = limit
+        self.current: Optional[DocNode] = None
+        self.undo_stack: List[DocNode] = []
+        self.redo_stack: List[DocNode] = []
+
+    def reset(self, root: OutlineNode):
+        self.current = snapshot(root)
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    def commit(self, root: OutlineNode) -> bool:
+        document = snapshot(root)
+        if document is self.current:
+            return False
+        if self.current is not None:
+            self.undo_stack.append(self.current)
+            if len(self.undo_stack) > self.limit:
+                del self.undo_stack[0]
+        self.current = document
+        self.redo_stack.clear()
+        return True
+
+    def can_undo(self) -> bool:
+        return bool(self.undo_stack)
+
+    def can_redo(self) -> bool:
+        return bool(self.redo_stack)
+
+    def undo(self, root: OutlineNode) -> Tuple[List[OutlineNode], List[OutlineNode]]:
+        # Uncommitted changes are committed first so they can be redone.
+        self.commit(root)
+        self.redo_stack.append(self.current)
+        self.current = self.undo_stack.pop()
+        return restore(root, self.current)
+
+    def redo(self, root: OutlineNode) -> Tuple[List[OutlineNode], List[OutlineNode]]:
+        self.undo_stack.append(self.current)
+        self.current = self.redo_stack.pop()
+        return restore(root, self.current)
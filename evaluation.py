@@ -0,0 +1,535 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from evaluation_cache import EvaluationCache
+from json_stream import MemberStreamParser
+from metrics import metrics
+from scene_chunks import split_scene
+from scheduler import RequestCancelled, RequestScheduler
+
+def parse_band(text: str) -> Tuple[int, int]:
+    low, _, high = text.partition("-")
+    return int(low), int(high or low)
+
+
+# Models in escalation order: every scene is scored by the first, and only
+# borderline or unparseable results are passed up to the next. A result is
+# borderline when at least ESCALATION_MIN_CRITERIA of its five scores fall
+# in ESCALATION_BAND; a single middling score is too common to count.
+EVALUATION_MODELS = [
+    model.strip() for model in
+    os.environ.get("EXPANSION_MODELS", "claude-instant-1.2,claude-2.1").split(",") if model.strip()
+]
+EVALUATION_MODEL = EVALUATION_MODELS[0]
+ESCALATION_BAND = parse_band(os.environ.get("EXPANSION_ESCALATION_BAND", "2-3"))
+ESCALATION_MIN_CRITERIA = int(os.environ.get("EXPANSION_ESCALATION_MIN_CRITERIA", "4"))
+EVALUATION_TEMPERATURE = 0
+EVALUATION_CONCURRENCY = int(os.environ.get("EXPANSION_CONCURRENCY", "4"))
+EVALUATION_CACHE_FILE = os.environ.get("EXPANSION_CACHE_FILE", ".evaluation_cache.sqlite")
+EVALUATION_CACHE_SIZE = int(os.environ.get("EXPANSION_CACHE_SIZE", "10000"))
+# The story outline is sent with every request but, unless this is set, left
+# out of the cache key, so restructuring the tree does not re-bill scenes
+# whose text is unchanged.
+CACHE_KEY_STORY_CONTEXT = os.environ.get("EXPANSION_CACHE_KEY_STORY_CONTEXT", "0") == "1"
+
+SCENE_LEVELS = (5, 6)
+MIN_SCENE_LENGTH = 500
+
+EVALUATION_CRITERIA = (
+    "Dialogue", "Hooks_and_Transitions", "Theme_Subtext", "Prose_Quality", "Relevance_to_Overall_Story"
+)
+CRITERIA_RETRIES = int(os.environ.get("EXPANSION_CRITERIA_RETRIES", "2"))
+
+CHUNK_THRESHOLD = int(os.environ.get("EXPANSION_CHUNK_THRESHOLD", "12000"))
+CHUNK_SIZE = int(os.environ.get("EXPANSION_CHUNK_SIZE", "6000"))
+CHUNK_OVERLAP = int(os.environ.get("EXPANSION_CHUNK_OVERLAP", "600"))
+
+# Message Batches calls do not go through the RequestScheduler, so their
+# client keeps the SDK's own retries.
+BATCH_CLIENT_RETRIES = int(os.environ.get("EXPANSION_BATCH_CLIENT_RETRIES", "4"))
+
+client = None
+batch_client = None
+client_lock = threading.Lock()
+
+
+def get_client():
+    global client
+    if client is None:
+        with client_lock:
+            if client is None:
+                import anthropic
+                # Retries are left to the RequestScheduler, which paces them
+                # against the rate limits shared by every worker.
+                client = anthropic.Anthropic(
+                    api_key = os.environ.get("ANTHROPIC_API_KEY"),
+                    max_retries = 0
+                )
+    return client
+
+
+def get_batch_client():
+    global batch_client
+    if batch_client is None:
+        with client_lock:
+            if batch_client is None:
+                import anthropic
+                batch_client = anthropic.Anthropic(
+                    api_key = os.environ.get("ANTHROPIC_API_KEY"),
+                    max_retries = BATCH_CLIENT_RETRIES
+                )
+    return batch_client
+
+
+def send_request(params: Dict[str, Any]):
+    return get_client().messages.create(**params)
+
+
+def stream_request(params: Dict[str, Any], on_text: Callable[[str], None]):
+    with get_client().messages.stream(**params) as stream:
+        for text in stream.text_stream:
+            on_text(text)
+        return stream.get_final_message()
+
+
+EVALUATION_INSTRUCTIONS = """Evaluate the following scene based on these criteria:
+1. Dialogue
+2. Hooks and Transitions
+3. Theme/Subtext
+4. Prose Quality
+5. Relevance to Overall Story
+
+For each criterion, provide a score from 1 to 5, where:
+1 = Poor (Red)
+2 = Fair (Orange)
+3 = Good (Yellow)
+4 = Very Good (Light Green)
+5 = Excellent (Dark Green)
+
+Provide your evaluation as a JSON object with the following structure:
+{
+    "Dialogue": {
+        "score": <int>,
+        "comment": <string>
+    },
+    "Hooks_and_Transitions": {
+        "score": <int>,
+        "comment": <string>
+    },
+    "Theme_Subtext": {
+        "score": <int>,
+        "comment": <string>
+    },
+    "Prose_Quality": {
+        "score": <int>,
+        "comment": <string>
+    },
+    "Relevance_to_Overall_Story": {
+        "score": <int>,
+        "comment": <string>
+    }
+}
+
+The scene is given in the user message. Respond with the JSON object only."""
+
+STORY_OUTLINE_MAX_CHARS = 20000
+
+
+def build_story_outline(root, max_chars: int = STORY_OUTLINE_MAX_CHARS) -> str:
+    lines = []
+    length = 0
+    stack = [(child, 0) for child in reversed(root.children)]
+    while stack:
+        node, depth = stack.pop()
+        line = f"{'  ' * depth}- {node.title}"
+        length += len(line) + 1
+        if length > max_chars:
+            lines.append("...")
+            break
+        lines.append(line)
+        stack.extend((child, depth + 1) for child in reversed(node.children))
+    return "\n".join(lines)
+
+
+def create_evaluation_prompt(scene_content: str, story_context: str = "") -> str:
+    parts = [EVALUATION_INSTRUCTIONS]
+    if story_context:
+        parts.append(f"Story outline:\n{story_context}")
+    parts.append(f"Scene content:\n{scene_content}")
+    return "\n\n".join(parts)
+
+
+def parse_error(comment: str) -> Dict[str, Any]:
+    return {
+        "error": {
+            "score": 0,
+            "comment": comment
+        }
+    }
+
+
+def response_text(message) -> str:
+    if isinstance(message.content, list) and len(message.content) > 0 and hasattr(message.content[0], 'text'):
+        return message.content[0].text
+    return str(message.content)
+
+
+def is_valid_criterion(criterion: str, data: Any) -> bool:
+    return (criterion in EVALUATION_CRITERIA and isinstance(data, dict)
+            and isinstance(data.get('score'), int) and isinstance(data.get('comment'), str))
+
+
+def missing_criteria(evaluation: Dict[str, Any]) -> List[str]:
+    return [criterion for criterion in EVALUATION_CRITERIA if criterion not in evaluation]
+
+
+def parse_evaluation(text: str) -> Dict[str, Any]:
+    try:
+        evaluation = json.loads(text)
+        if isinstance(evaluation, dict):
+            return evaluation
+    except json.JSONDecodeError:
+        pass
+    # Keep whichever criteria are well formed on their own.
+    evaluation = {}
+
+    def salvage(criterion: str, data: Any):
+        if is_valid_criterion(criterion, data):
+            evaluation[criterion] = data
+
+    MemberStreamParser(salvage).feed(text)
+    return evaluation or parse_error("Failed to parse evaluation response")
+
+
+def record_response(message, evaluation: Dict[str, Any], seconds: Optional[float] = None):
+    usage = getattr(message, 'usage', None)
+    metrics.increment('api_requests')
+    metrics.record_usage(usage)
+    if seconds is not None:
+        metrics.observe('api_request_seconds', seconds)
+    if "error" in evaluation:
+        metrics.increment('parse_failures')
+    metrics.event(
+        'evaluation',
+        seconds=seconds,
+        input_tokens=getattr(usage, 'input_tokens', None),
+        output_tokens=getattr(usage, 'output_tokens', None),
+        cache_read_input_tokens=getattr(usage, 'cache_read_input_tokens', None),
+        parse_failure="error" in evaluation
+    )
+
+
+def scene_label(part: Optional[Tuple[int, int]]) -> str:
+    if part is None:
+        return "Scene content"
+    number, count = part
+    return (f"Excerpt {number} of {count} from a longer scene (neighbouring excerpts overlap). "
+            f"Judge only what this excerpt shows.\nScene content")
+
+
+def build_request_params(scene_content: str, story_context: str = "",
+                         criteria: Optional[List[str]] = None,
+                         part: Optional[Tuple[int, int]] = None,
+                         model: str = EVALUATION_MODEL) -> Dict[str, Any]:
+    # The rubric and the story outline form a prefix shared by every scene in
+    # a run, so it is sent as cacheable system blocks ahead of the scene.
+    system = [{"type": "text", "text": EVALUATION_INSTRUCTIONS}]
+    if story_context:
+        system.append({"type": "text", "text": f"Story outline, for judging relevance:\n{story_context}"})
+    system[-1]["cache_control"] = {"type": "ephemeral"}
+
+    user_text = f"{scene_label(part)}:\n{scene_content}"
+    if criteria:
+        # Follow-up for criteria a previous response left out; the system
+        # prefix is unchanged, so it is still served from the prompt cache.
+        user_text += f"\n\nInclude only these criteria in the JSON object: {', '.join(criteria)}"
+
+    return {
+        "model": model,
+        "max_tokens": 1000,
+        "temperature": EVALUATION_TEMPERATURE,
+        "system": system,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": user_text
+                    }
+                ]
+            }
+        ]
+    }
+
+
+def tag_evaluation(evaluation: Any, model: str, tier: int) -> Dict[str, Any]:
+    if not isinstance(evaluation, dict):
+        return parse_error("Failed to parse evaluation response")
+    return {
+        criterion: dict(data, model=model, tier=tier)
+        if criterion in EVALUATION_CRITERIA and isinstance(data, dict) else data
+        for criterion, data in evaluation.items()
+    }
+
+
+def needs_escalation(evaluation: Dict[str, Any], band: Tuple[int, int] = ESCALATION_BAND,
+                     min_criteria: int = ESCALATION_MIN_CRITERIA) -> bool:
+    if "error" in evaluation or missing_criteria(evaluation):
+        return True
+    low, high = band
+    borderline = sum(low <= evaluation[criterion]['score'] <= high for criterion in EVALUATION_CRITERIA)
+    return borderline >= min_criteria
+
+
+def reduce_evaluations(parts: List[Tuple[int, int, Dict[str, Any]]]) -> Dict[str, Any]:
+    # Folds per-chunk evaluations, given with each chunk's 1-based number in
+    # the scene and its length, into one: the score is the length-weighted
+    # mean and the comment comes from the weakest chunk.
+    evaluation = {}
+    for criterion in EVALUATION_CRITERIA:
+        scored = [(length, number, part[criterion]) for number, length, part in parts if criterion in part]
+        if not scored:
+            continue
+        total = sum(length for length, _, _ in scored)
+        score = sum(length * data['score'] for length, _, data in scored) / total
+        scores = [data['score'] for _, _, data in scored]
+        _, weakest, data = min(scored, key=lambda item: item[2]['score'])
+        evaluation[criterion] = {
+            "score": int(score + 0.5),
+            "comment": (f"Across {len(scored)} excerpts (scores {min(scores)}-{max(scores)}); "
+                        f"weakest, excerpt {weakest}: {data['comment']}")
+        }
+        if 'tier' in data:
+            # Report the strongest tier that scored any excerpt.
+            top = max((data for _, _, data in scored), key=lambda data: data.get('tier', 0))
+            evaluation[criterion].update(model=top['model'], tier=top['tier'])
+    return evaluation
+
+
+class SceneEvaluator:
+    # With `chunked`, scenes longer than `chunk_threshold` characters are
+    # split into overlapping excerpts that are evaluated in parallel and
+    # reduced into a single five-criterion evaluation.
+    #
+    # Each scene (or excerpt) runs through the `models` cascade; every
+    # criterion records the model and 1-based tier that produced it.
+    def __init__(self, cache_file: Optional[str] = EVALUATION_CACHE_FILE,
+                 cache_size: int = EVALUATION_CACHE_SIZE,
+                 concurrency: int = EVALUATION_CONCURRENCY,
+                 chunked: bool = False, chunk_threshold: int = CHUNK_THRESHOLD,
+                 chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+                 models: Optional[List[str]] = None,
+                 escalation_band: Tuple[int, int] = ESCALATION_BAND,
+                 escalation_min_criteria: int = ESCALATION_MIN_CRITERIA,
+                 key_story_context: bool = CACHE_KEY_STORY_CONTEXT):
+        self.cache = EvaluationCache(cache_file, cache_size) if cache_file else None
+        self.key_story_context = key_story_context
+        self.models = models or EVALUATION_MODELS
+        self.escalation_band = escalation_band
+        self.escalation_min_criteria = escalation_min_criteria
+        self.scheduler = RequestScheduler(send_request, max_concurrency=concurrency)
+        self.story_context = ""
+        self.chunked = chunked
+        self.chunk_threshold = chunk_threshold
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def cache_key(self, scene_content: str, part: Optional[Tuple[int, int]] = None,
+                  model: str = EVALUATION_MODEL, story_context: Optional[str] = None) -> str:
+        # Excerpts are keyed by their text alone, so inserting or removing
+        # an excerpt does not renumber and invalidate the others.
+        if part is not None:
+            scene_content = f"Excerpt:\n{scene_content}"
+        if not self.key_story_context:
+            story_context = ""
+        elif story_context is None:
+            story_context = self.story_context
+        return EvaluationCache.make_key(
+            scene_content, EVALUATION_INSTRUCTIONS + story_context,
+            model, EVALUATION_TEMPERATURE
+        )
+
+    def cached(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        if not self.cache:
+            return None
+        evaluation = self.cache.get(cache_key)
+        metrics.increment('cache_hits' if evaluation is not None else 'cache_misses')
+        return evaluation
+
+    def store(self, cache_key: str, evaluation: Dict[str, Any]):
+        if (self.cache and isinstance(evaluation, dict) and "error" not in evaluation
+                and not missing_criteria(evaluation)):
+            self.cache.put(cache_key, evaluation)
+
+    def request(self, scene_content: str, criteria: Optional[List[str]],
+                on_criterion: Callable[[str, Dict[str, Any]], None],
+                part: Optional[Tuple[int, int]] = None, model: str = EVALUATION_MODEL,
+                cancelled: Optional[threading.Event] = None):
+        # Streams one response, passing each criterion on as soon as its
+        # object is complete. A retried stream starts a fresh parser. Only
+        # the last attempt is timed; waiting for the scheduler and backing
+        # off are reported as scheduler_wait_seconds.
+        timing = {'seconds': 0.0}
+
+        def send(params: Dict[str, Any]):
+            start = time.perf_counter()
+            try:
+                return stream_request(params, MemberStreamParser(on_criterion).feed)
+            finally:
+                timing['seconds'] = time.perf_counter() - start
+
+        try:
+            message = self.scheduler.create(
+                build_request_params(scene_content, self.story_context, criteria, part, model), send, cancelled
+            )
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            metrics.increment('api_errors')
+            metrics.event('api_error', seconds=timing['seconds'], error=str(e))
+            raise
+        return message, timing['seconds']
+
+    def evaluate(self, scene_content: str,
+                 on_criterion: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 chunked: Optional[bool] = None, cancelled: Optional[threading.Event] = None) -> Dict[str, Any]:
+        # Setting `cancelled` cuts short any wait for the scheduler and
+        # raises RequestCancelled.
+        if chunked is None:
+            chunked = self.chunked
+        if chunked and len(scene_content) > self.chunk_threshold:
+            chunks = split_scene(scene_content, self.chunk_size, self.chunk_overlap)
+            if len(chunks) > 1:
+                return self.evaluate_chunks(chunks, cancelled)
+        return self.evaluate_part(scene_content, None, on_criterion, cancelled)
+
+    def evaluate_chunks(self, chunks: List[str], cancelled: Optional[threading.Event] = None) -> Dict[str, Any]:
+        # Excerpts are cached individually, so editing one part of a long
+        # scene only re-evaluates the excerpts that changed. An excerpt whose
+        # request fails is left out of the reduction; the scene fails only
+        # when none of its excerpts could be evaluated.
+        count = len(chunks)
+        metrics.increment('chunked_scenes')
+        metrics.increment('scene_chunks', count)
+        parts = []
+        failure: Optional[Exception] = None
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            futures = [
+                executor.submit(self.evaluate_part, chunk, (number, count), None, cancelled)
+                for number, chunk in enumerate(chunks, 1)
+            ]
+            for number, (chunk, future) in enumerate(zip(chunks, futures), 1):
+                try:
+                    parts.append((number, len(chunk), future.result()))
+                except RequestCancelled as e:
+                    failure = e
+                except Exception as e:
+                    failure = e
+                    metrics.increment('chunk_failures')
+                    metrics.event('chunk_failure', part=number, parts=count, error=str(e))
+                    print(f"Evaluation of excerpt {number} of {count} failed: {e}")
+        if not parts or isinstance(failure, RequestCancelled):
+            raise failure
+        evaluation = reduce_evaluations([part for part in parts if "error" not in part[2]])
+        return evaluation or parse_error("Failed to parse evaluation response")
+
+    def evaluate_part(self, scene_content: str, part: Optional[Tuple[int, int]] = None,
+                      on_criterion: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                      cancelled: Optional[threading.Event] = None) -> Dict[str, Any]:
+        for tier, model in enumerate(self.models, 1):
+            last = tier == len(self.models)
+            # Criteria missing below the top tier are a reason to escalate
+            # rather than to ask the same model again.
+            retries = CRITERIA_RETRIES if last else 0
+            evaluation = self.evaluate_tier(scene_content, part, model, tier, retries, on_criterion, cancelled)
+            if last or not needs_escalation(evaluation, self.escalation_band, self.escalation_min_criteria):
+                return evaluation
+            metrics.increment('escalations')
+            metrics.event('escalation', model=self.models[tier], tier=tier + 1)
+            print(f"Escalating evaluation to {self.models[tier]}")
+
+    def evaluate_tier(self, scene_content: str, part: Optional[Tuple[int, int]], model: str, tier: int,
+                      retries: int = CRITERIA_RETRIES,
+                      on_criterion: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                      cancelled: Optional[threading.Event] = None) -> Dict[str, Any]:
+        cache_key = self.cache_key(scene_content, part, model)
+        cached = self.cached(cache_key)
+        if cached is not None:
+            return cached
+
+        evaluation: Dict[str, Any] = {}
+
+        def accept(criterion: str, data: Any):
+            if is_valid_criterion(criterion, data) and criterion not in evaluation:
+                evaluation[criterion] = data = dict(data, model=model, tier=tier)
+                if on_criterion:
+                    on_criterion(criterion, data)
+
+        criteria = None
+        for attempt in range(1 + retries):
+            message, seconds = self.request(scene_content, criteria, accept, part, model, cancelled)
+            criteria = missing_criteria(evaluation)
+            record_response(message, evaluation or parse_error("Failed to parse evaluation response"), seconds)
+            if not criteria:
+                break
+            metrics.increment('missing_criteria', len(criteria))
+            if attempt == retries:
+                break
+            print(f"Re-requesting missing criteria: {', '.join(criteria)}")
+
+        if not evaluation:
+            return parse_error("Failed to parse evaluation response")
+        self.store(cache_key, evaluation)
+        return evaluation
+
+
+def is_scene_level(level: int) -> bool:
+    return level in SCENE_LEVELS
+
+
+def collect_scene_jobs(root) -> List[Tuple[Any, str]]:
+    jobs = []
+    for node in root.iter_nodes():
+        if is_scene_level(node.level):
+            scene_content = node.content or ""
+            if len(scene_content) >= MIN_SCENE_LENGTH:
+                jobs.append((node, scene_content))
+            else:
+                print(f"Skipping scene {node.title} (less than {MIN_SCENE_LENGTH} characters)")
+    return jobs
+
+
+def evaluate_scenes(jobs: List[Tuple[Any, str]], evaluate: Callable[..., Dict[str, Any]],
+                    concurrency: int = EVALUATION_CONCURRENCY,
+                    cancelled: Optional[threading.Event] = None,
+                    on_criterion: Optional[Callable[[Any, str, Dict[str, Any]], None]] = None
+                    ) -> Iterator[Tuple[Any, Optional[Dict[str, Any]], Optional[str]]]:
+    # Yields (key, evaluation, error) as each scene finishes. Jobs skipped
+    # or cut short by cancellation yield neither an evaluation nor an error;
+    # `evaluate` gets the event as `cancelled` to stop waiting on the
+    # scheduler. With `on_criterion`, it also receives a per-criterion
+    # callback and partial results are reported as (key, criterion, data).
+    if not jobs:
+        return
+
+    def run(key: Any, scene_content: str) -> Optional[Dict[str, Any]]:
+        if cancelled is not None and cancelled.is_set():
+            return None
+        if on_criterion is None:
+            return evaluate(scene_content, cancelled=cancelled)
+        return evaluate(scene_content, lambda criterion, data: on_criterion(key, criterion, data), cancelled=cancelled)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(jobs)))) as executor:
+        futures = {executor.submit(run, key, scene_content): key for key, scene_content in jobs}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except RequestCancelled:
+                yield futures[future], None, None
+            except Exception as e:
+                yield futures[future], None, str(e)
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+
+
+class EvaluationCache:
+    def __init__(self, filename: str, max_entries: int = 10000):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS evaluations ("
+            "key TEXT PRIMARY KEY, evaluation TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS evaluations_last_used ON evaluations (last_used)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(scene_content: str, prompt_template: str, model: str, temperature: float) -> str:
+        digest = hashlib.sha256()
+        for part in (scene_content, prompt_template, model, repr(temperature)):
+            encoded = part.encode('utf-8')
+            digest.update(len(encoded).to_bytes(8, 'big'))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT evaluation FROM evaluations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE evaluations SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.connection.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, evaluation: Dict[str, Any]):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO evaluations (key, evaluation, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(evaluation), time.time())
+            )
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        count = self.connection.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.connection.execute(
+                "DELETE FROM evaluations WHERE key IN "
+                "(SELECT key FROM evaluations ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM evaluations")
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
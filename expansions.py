@@ -1,29 +1,101 @@
 import sys
 import os
-from datetime import datetime
-from typing import Tuple, Dict, Any
-import json
-import requests
-import anthropic
+import threading
+import time
+from typing import Tuple, Dict, Any, List, Optional
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QTreeWidget, QTreeWidgetItem, QTextEdit,
-    QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QInputDialog, QLabel
+    QApplication, QMainWindow, QTreeView, QTextEdit,
+    QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QInputDialog, QLabel,
+    QProgressDialog
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import QObject, QModelIndex, pyqtSignal
 from PyQt5.QtGui import QFont, QColor
 
-client = anthropic.Anthropic(
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
+from autosave import Autosaver
+from document import History, is_attached, snapshot
+from evaluation import (
+    EVALUATION_CONCURRENCY, MIN_SCENE_LENGTH, SceneEvaluator, build_story_outline, collect_scene_jobs,
+    create_evaluation_prompt, evaluate_scenes, is_scene_level
 )
+from file_watcher import OutlineWatcher
+from message_batches import BatchEvaluator, job_path
+from metrics import metrics
+from metrics_panel import MetricsPanel
+from outline_model import OutlineModel
+from outline_parser import OutlineNode, parse_file
+from outline_writer import iter_outline_chunks
+from pip_delegate import EvaluationPipDelegate, color_for_score
+from search_index import SearchIndex
+from search_panel import SearchPanel
+from snapshot_store import SnapshotStore
+
+SNAPSHOT_DIRECTORY = os.environ.get("EXPANSION_SNAPSHOT_DIR", ".outline_snapshots")
+
+class EvaluationRunner(QObject):
+    scene_evaluated = pyqtSignal(object, object)
+    criterion_evaluated = pyqtSignal(object, str, object)
+    scene_failed = pyqtSignal(object, str)
+    progress = pyqtSignal(int, int)
+    failed = pyqtSignal(str)
+    finished = pyqtSignal(bool)
+
+    def __init__(self, run_jobs, parent=None):
+        super().__init__(parent)
+        self.run_jobs = run_jobs
+        self.cancelled = threading.Event()
+        self.total = 0
+        self.error: Optional[str] = None
+
+    def start(self, jobs: List[Tuple[Any, str]]):
+        self.total = len(jobs)
+        threading.Thread(target=self.run, args=(jobs,), daemon=True).start()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self, jobs: List[Tuple[Any, str]]):
+        # `finished` is always emitted, even when the run itself fails (say
+        # a batch request error), so the editor never stays in a run.
+        completed = 0
+        try:
+            for key, result, error in self.run_jobs(jobs, self.cancelled):
+                completed += 1
+                if error is not None:
+                    self.scene_failed.emit(key, error)
+                elif result is not None and not self.cancelled.is_set():
+                    self.scene_evaluated.emit(key, result)
+                self.progress.emit(completed, self.total)
+        except Exception as e:
+            self.error = str(e)
+            self.failed.emit(self.error)
+        finally:
+            self.finished.emit(self.cancelled.is_set())
 
 class ExpansionEditor(QMainWindow):
+    search_index_built = pyqtSignal(object, int)
+
     def __init__(self):
         super().__init__()
         self.current_item = None
         self.tree = None
         self.text_edit = None
+        self.evaluation_runner = None
+        self.evaluation_progress = None
+        self.metrics_panel = None
+        self.search_index = SearchIndex()
+        self.search_executor = ThreadPoolExecutor(max_workers=1)
+        self.search_generation = 0
+        self.search_index_built.connect(self.search_index_ready)
+        self.evaluator = SceneEvaluator()
+        self.batch_evaluator = BatchEvaluator(self.evaluator)
+        self.snapshot_store = SnapshotStore(SNAPSHOT_DIRECTORY)
+        self.history = History()
+        self.autosaver = Autosaver('outline.txt', lambda: snapshot(self.model.root), parent=self)
+        self.watcher = OutlineWatcher('outline.txt', lambda: self.autosaver.signature, parent=self)
+        self.watcher.changed.connect(self.external_change)
         self.rubric_tooltip = self.extract_rubric_from_prompt()
         self.init_ui()
 
@@ -38,7 +110,13 @@ class ExpansionEditor(QMainWindow):
         self.create_text_edit()
         button_layout = self.create_button_layout()
 
-        main_layout.addWidget(self.tree)
+        self.search_panel = SearchPanel(self.search_index)
+        self.search_panel.node_activated.connect(self.jump_to_node)
+        tree_layout = QVBoxLayout()
+        tree_layout.addWidget(self.search_panel)
+        tree_layout.addWidget(self.tree, 1)
+
+        main_layout.addLayout(tree_layout)
         main_layout.addWidget(self.text_edit)
         main_layout.addLayout(button_layout)
 
@@ -46,6 +124,7 @@ class ExpansionEditor(QMainWindow):
         self.setCentralWidget(main_widget)
 
         self.load_or_create_file('outline.txt')
+        self.resume_batch_evaluation()
 
     def load_or_create_file(self, filename: str):
         if not os.path.exists(filename):
@@ -84,7 +163,7 @@ Continue your story here.
             criteria_text = rubric_match.group(1).strip()
             criteria = re.findall(criteria_pattern, criteria_text, re.DOTALL)
             
-            scores_text = re.search(r"For each criterion, provide a score from 1 to 5, where:(.*?)Scene content:", prompt, re.DOTALL)
+            scores_text = re.search(r"For each criterion, provide a score from 1 to 5, where:(.*?)Provide your evaluation", prompt, re.DOTALL)
             if scores_text:
                 scores = re.findall(score_pattern, scores_text.group(1))
                 
@@ -100,9 +179,12 @@ Continue your story here.
         return "Rubric information not found in the prompt."
 
     def create_tree_widget(self):
-        self.tree = QTreeWidget()
-        self.tree.setHeaderLabel('Outline')
-        self.tree.itemClicked.connect(self.item_clicked)
+        self.model = OutlineModel(parent=self)
+        self.tree = QTreeView()
+        self.tree.setModel(self.model)
+        self.tree.setItemDelegate(EvaluationPipDelegate(self.rubric_tooltip, self.tree))
+        self.tree.setUniformRowHeights(True)
+        self.tree.clicked.connect(self.item_clicked)
         
         tree_font = self.tree.font()
         tree_font.setPointSize(14)
@@ -120,13 +202,19 @@ Continue your story here.
         buttons = [
             ('Add Node', self.add_node),
             ('Save', self.save_file),
+            ('Undo', self.undo),
+            ('Redo', self.redo),
+            ('Restore Snapshot', self.restore_snapshot),
             ('Move Up', self.move_node_up),
             ('Move Down', self.move_node_down),
             ('Promote', self.promote_node),
             ('Demote', self.demote_node),
             ('Evaluate Scene', self.evaluate_scene),
             ('Evaluate All', self.evaluate_all_scenes),
-            ('Clear All Evaluations', self.clear_all_evaluations)
+            ('Evaluate All (Chunked)', self.evaluate_all_scenes_chunked),
+            ('Evaluate All (Batch)', self.evaluate_all_scenes_batch),
+            ('Clear All Evaluations', self.clear_all_evaluations),
+            ('Metrics', self.show_metrics)
         ]
 
         for button_text, button_function in buttons:
@@ -141,405 +229,422 @@ Continue your story here.
         button_layout.addStretch(1)
         return button_layout
 
+    def show_metrics(self):
+        if self.metrics_panel is None:
+            self.metrics_panel = MetricsPanel(self)
+        self.metrics_panel.show()
+        self.metrics_panel.raise_()
+
     def clear_all_evaluations(self):
-        root = self.tree.invisibleRootItem()
-        self.clear_evaluations_recursive(root)
+        for node in self.model.root.iter_nodes():
+            if node.evaluation:
+                self.model.set_evaluation(node, None)
         self.save_file()
         print("All evaluations have been cleared.")
 
-    def clear_evaluations_recursive(self, item: QTreeWidgetItem):
-        item.setData(0, Qt.UserRole + 2, None)
-        
-        widget = item.treeWidget().itemWidget(item, 0)
-        if widget:
-            layout = widget.layout()
-            while layout.count() > 2:
-                widget = layout.takeAt(2).widget()
-                if widget:
-                    widget.deleteLater()
-
-        for i in range(item.childCount()):
-            self.clear_evaluations_recursive(item.child(i))
-
     def load_file(self, filename: str):
-        with open(filename, 'r', encoding='utf-8') as file:
-            content = file.read()
-
-        self.tree.clear()
-        stack = [self.tree.invisibleRootItem()]
-        current_level = 0
-        current_content = ""
-        current_evaluation = None
-
-        for line in content.split('\n'):
-            line = line.strip()
-            if line.startswith('[LEVEL') and ']' in line:
-                if current_content:
-                    stack[-1].setData(0, Qt.UserRole + 1, current_content.strip())
-                    if current_evaluation:
-                        stack[-1].setData(0, Qt.UserRole + 2, current_evaluation)
-                        self.update_scene_evaluation_display(stack[-1], current_evaluation)
-                    current_content = ""
-                    current_evaluation = None
-                self.process_level_line(line, stack, current_level)
-            elif line.startswith('[/LEVEL'):
-                if current_content:
-                    stack[-1].setData(0, Qt.UserRole + 1, current_content.strip())
-                    if current_evaluation:
-                        stack[-1].setData(0, Qt.UserRole + 2, current_evaluation)
-                        self.update_scene_evaluation_display(stack[-1], current_evaluation)
-                    current_content = ""
-                    current_evaluation = None
-                stack.pop()
-                current_level -= 1
-            elif line.startswith('[EVALUATION]'):
-                current_evaluation = json.loads(line[12:])
-            else:
-                current_content += line + "\n"
-
-        if current_content and stack:
-            stack[-1].setData(0, Qt.UserRole + 1, current_content.strip())
-            if current_evaluation:
-                stack[-1].setData(0, Qt.UserRole + 2, current_evaluation)
-                self.update_scene_evaluation_display(stack[-1], current_evaluation)
-
-        self.tree.expandAll()
-
-    def process_level_line(self, line: str, stack: list, current_level: int):
-        try:
-            level = int(line[6:line.index(']')])
-            title = line[line.index(']')+1:].strip()
-            item = QTreeWidgetItem([title])
-            item.setData(0, Qt.UserRole, (line, f"[/LEVEL {level}]"))
-            
-            while current_level >= level:
-                stack.pop()
-                current_level -= 1
-            
-            stack[-1].addChild(item)
-            stack.append(item)
-            current_level = level
-        except ValueError:
-            print(f"Skipping invalid line: {line}")
-
-    def item_clicked(self, item: QTreeWidgetItem, column: int):
+        start = time.perf_counter()
+        self.current_item = None
+        self.model.set_root(parse_file(filename))
+        self.history.reset(self.model.root)
+        self.autosaver.mark_saved(self.history.current)
+        self.watcher.watch()
+        self.rebuild_search_index()
+        self.tree.expandToDepth(0)
+        metrics.record_io('load', time.perf_counter() - start, os.path.getsize(filename), filename)
+
+    def rebuild_search_index(self):
+        # Indexing a large outline takes longer than parsing it, so it runs
+        # on a worker from the loaded snapshot; edits made meanwhile are
+        # recorded by the index and re-read when the build is swapped in.
+        self.search_generation += 1
+        self.search_index.begin_rebuild()
+        self.search_panel.refresh()
+        self.search_executor.submit(self.build_search_index, self.history.current, self.search_generation)
+
+    def build_search_index(self, document, generation: int):
+        start = time.perf_counter()
+        index = SearchIndex()
+        index.build_document(document)
+        metrics.observe('search_index_build_seconds', time.perf_counter() - start)
+        self.search_index_built.emit(index, generation)
+
+    def search_index_ready(self, index: SearchIndex, generation: int):
+        if generation != self.search_generation:
+            return
+        self.search_index.finish_rebuild(index, self.model.in_tree)
+        self.search_panel.refresh()
+
+    def current_node(self) -> Optional[OutlineNode]:
+        index = self.tree.currentIndex()
+        if index.isValid():
+            return self.model.node_from_index(index)
+        return None
+
+    def select_node(self, node: OutlineNode):
+        self.tree.setCurrentIndex(self.model.index_for_node(node))
+
+    def jump_to_node(self, node: OutlineNode):
+        index = self.model.index_for_node(node)
+        self.tree.setCurrentIndex(index)
+        self.tree.scrollTo(index)
+        self.item_clicked(index)
+
+    def item_clicked(self, index: QModelIndex):
         if self.current_item:
             self.save_current_item_content()
-        self.current_item = item
-        content = item.data(0, Qt.UserRole + 1) or ""
-        self.text_edit.setText(content)
+        self.current_item = self.model.node_from_index(index)
+        self.text_edit.setText(self.current_item.content or "")
 
     def save_current_item_content(self):
         if self.current_item:
             content = self.text_edit.toPlainText()
-            self.current_item.setData(0, Qt.UserRole + 1, content)
+            if content != (self.current_item.content or ""):
+                self.current_item.content = content
+                self.search_index.update(self.current_item)
+                self.save_file_structure()
 
     def add_node(self):
-        current_item = self.tree.currentItem()
-        if current_item is None:
-            level = 1
-            parent = self.tree.invisibleRootItem()
-        else:
-            start_tag, _ = current_item.data(0, Qt.UserRole)
-            parent_level = int(start_tag[6:start_tag.index(']')])
-            level = parent_level + 1
-            parent = current_item
+        parent = self.current_node() or self.model.root
 
         title, ok = QInputDialog.getText(self, 'Add Node', 'Enter node title:')
         if ok and title:
-            new_item = QTreeWidgetItem([title])
-            start_tag = f"[LEVEL {level}]{title}"
-            end_tag = f"[/LEVEL {level}]"
-            new_item.setData(0, Qt.UserRole, (start_tag, end_tag))
-            parent.addChild(new_item)
-            self.tree.expandItem(parent)
+            node = OutlineNode(title)
+            self.model.insert_node(parent, len(parent.children), node)
+            self.search_index.update(node)
+            self.tree.expand(self.model.index_for_node(parent))
             
             self.save_file_structure()
 
     def save_file(self):
         self.save_current_item_content()
-        content = self.generate_content(self.tree.invisibleRootItem())
-        self.save_to_file('outline.txt', content)
-        self.create_timestamped_copy(content)
-
-    def save_to_file(self, filename: str, content: str):
-        with open(filename, 'w', encoding='utf-8') as file:
-            file.write(content)
-        print(f"Saved to: {filename}")
-
-    def create_timestamped_copy(self, content: str):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"outline_{timestamp}.txt"
-        self.save_to_file(filename, content)
-
-    def generate_content(self, parent_item: QTreeWidgetItem) -> str:
-        content = ""
-        for i in range(parent_item.childCount()):
-            child = parent_item.child(i)
-            start_tag, end_tag = child.data(0, Qt.UserRole)
-            content += f"{start_tag}\n"
-            
-            item_content = child.data(0, Qt.UserRole + 1) or ""
-            content += f"{item_content}\n"
-            
-            evaluation_data = child.data(0, Qt.UserRole + 2)
-            if evaluation_data:
-                content += f"[EVALUATION]{json.dumps(evaluation_data)}\n"
-            
-            child_content = self.generate_content(child)
-            if child_content:
-                content += child_content
-            
-            content += f"{end_tag}\n"
-        return content
+        self.save_file_structure()
+        self.autosaver.flush()
+        self.create_snapshot(snapshot(self.model.root))
+
+    def create_snapshot(self, document):
+        start = time.perf_counter()
+        snapshot_id = self.snapshot_store.create_document_snapshot(document)
+        metrics.record_io('snapshot', time.perf_counter() - start, self.snapshot_store.bytes_written, SNAPSHOT_DIRECTORY)
+        if snapshot_id:
+            print(f"Created snapshot {snapshot_id} ({self.snapshot_store.bytes_written} bytes written)")
+
+    def restore_snapshot(self):
+        snapshots = list(reversed(self.snapshot_store.list_snapshots()))
+        if not snapshots:
+            print("No snapshots available.")
+            return
+
+        labels = [f"{snapshot['created'][:19].replace('T', ' ')} ({snapshot['nodes']} nodes)" for snapshot in snapshots]
+        label, ok = QInputDialog.getItem(self, 'Restore Snapshot', 'Select snapshot:', labels, 0, False)
+        if ok and label:
+            snapshot = snapshots[labels.index(label)]
+            self.save_file()
+            self.current_item = None
+            self.text_edit.clear()
+            self.snapshot_store.restore(snapshot['id'], 'outline.txt')
+            self.load_file('outline.txt')
+            print(f"Restored snapshot: {snapshot['id']}")
+
+    def generate_content(self, parent_node: OutlineNode) -> str:
+        return "".join(iter_outline_chunks(parent_node))
 
     def save_file_structure(self):
-        content = self.generate_content(self.tree.invisibleRootItem())
-        with open('outline.txt', 'w', encoding='utf-8') as file:
-            file.write(content)
+        # An unchanged document is not rewritten; the snapshot is cached, so
+        # comparing it with the last one saved costs nothing.
+        changed = self.history.commit(self.model.root)
+        if changed or snapshot(self.model.root) is not self.autosaver.saved:
+            self.autosaver.mark_dirty()
+
+    def undo(self):
+        self.save_current_item_content()
+        if not self.history.can_undo():
+            print("Nothing to undo.")
+            return
+        self.apply_history(self.history.undo)
+
+    def redo(self):
+        if not self.history.can_redo():
+            print("Nothing to redo.")
+            return
+        self.apply_history(self.history.redo)
+
+    def apply_history(self, step):
+        root = self.model.root
+        expanded = [
+            node for node in self.model.fetched
+            if self.tree.isExpanded(self.model.index_for_node(node, fetch=False))
+        ]
+        selected = self.current_node()
+
+        changed, detached = self.model.rebuild(lambda: step(root))
+
+        for node in changed:
+            if node is not root:
+                self.search_index.update(node)
+        for node in detached:
+            self.search_index.remove(node)
+        self.search_panel.refresh()
+
+        for node in expanded:
+            if is_attached(node, root):
+                self.tree.expand(self.model.index_for_node(node))
+        if selected is not None and is_attached(selected, root):
+            self.select_node(selected)
+        if self.current_item is not None and is_attached(self.current_item, root):
+            self.text_edit.setText(self.current_item.content or "")
+        else:
+            self.current_item = None
+            self.text_edit.clear()
+        self.autosaver.mark_dirty()
+
+    def external_change(self, root: OutlineNode):
+        # Another program changed the file. Only the subtrees that differ
+        # from what we last read or wrote are patched, so expansion,
+        # selection and untouched evaluations stay as they are. Local edits
+        # not yet saved are kept and written back together with the merge.
+        start = time.perf_counter()
+        self.save_current_item_content()
+        local_changes = snapshot(self.model.root) is not self.autosaver.saved
+        changed, detached = self.model.merge(self.autosaver.saved, root)
+
+        for node in changed:
+            self.search_index.update(node)
+        for node in detached:
+            self.search_index.remove(node)
+        self.search_panel.refresh()
+        if self.current_item is not None and not is_attached(self.current_item, self.model.root):
+            self.current_item = None
+            self.text_edit.clear()
+        elif self.current_item in changed:
+            self.text_edit.setText(self.current_item.content or "")
+
+        self.history.commit(self.model.root)
+        if local_changes:
+            self.autosaver.mark_dirty()
+            self.autosaver.save_now()
+        else:
+            self.autosaver.saved = snapshot(self.model.root)
+        metrics.observe('external_change_seconds', time.perf_counter() - start)
+        print(f"Reloaded external changes: {len(changed)} nodes updated, {len(detached)} removed.")
 
     def move_node_up(self):
-        current_item = self.tree.currentItem()
-        if current_item:
-            self.move_node(current_item, -1)
+        current_node = self.current_node()
+        if current_node:
+            self.move_node(current_node, -1)
 
     def move_node_down(self):
-        current_item = self.tree.currentItem()
-        if current_item:
-            self.move_node(current_item, 1)
-
-    def move_node(self, item: QTreeWidgetItem, direction: int):
-        parent = item.parent() or self.tree.invisibleRootItem()
-        index = parent.indexOfChild(item)
-        if 0 <= index + direction < parent.childCount():
-            parent.takeChild(index)
-            parent.insertChild(index + direction, item)
-            self.tree.setCurrentItem(item)
+        current_node = self.current_node()
+        if current_node:
+            self.move_node(current_node, 1)
+
+    def move_node(self, node: OutlineNode, direction: int):
+        parent = node.parent
+        index = node.row()
+        if 0 <= index + direction < len(parent.children):
+            self.model.move_node(node, parent, index + direction)
+            self.select_node(node)
             self.save_file_structure()
 
     def promote_node(self):
-        current_item = self.tree.currentItem()
-        if current_item:
-            parent = current_item.parent()
-            if parent and parent.parent():
-                grand_parent = parent.parent()
-                index = parent.indexOfChild(current_item)
-                parent.takeChild(index)
-                grand_parent_index = grand_parent.indexOfChild(parent)
-                grand_parent.insertChild(grand_parent_index + 1, current_item)
-                self.update_node_level(current_item, -1)
-                self.tree.setCurrentItem(current_item)
+        current_node = self.current_node()
+        if current_node:
+            parent = current_node.parent
+            if parent is not self.model.root:
+                grand_parent = parent.parent
+                self.model.move_node(current_node, grand_parent, parent.row() + 1)
+                self.select_node(current_node)
                 self.save_file_structure()
 
     def demote_node(self):
-        current_item = self.tree.currentItem()
-        if current_item:
-            parent = current_item.parent() or self.tree.invisibleRootItem()
-            index = parent.indexOfChild(current_item)
+        current_node = self.current_node()
+        if current_node:
+            parent = current_node.parent
+            index = current_node.row()
             if index > 0:
-                sibling = parent.child(index - 1)
-                parent.takeChild(index)
-                sibling.addChild(current_item)
-                self.update_node_level(current_item, 1)
-                self.tree.setCurrentItem(current_item)
+                sibling = parent.children[index - 1]
+                self.model.move_node(current_node, sibling, len(sibling.children))
+                self.select_node(current_node)
                 self.save_file_structure()
 
-    def update_node_level(self, item: QTreeWidgetItem, level_change: int):
-        start_tag, end_tag = item.data(0, Qt.UserRole)
-        current_level = int(start_tag[6:start_tag.index(']')])
-        new_level = current_level + level_change
-        new_start_tag = f"[LEVEL {new_level}]{item.text(0)}"
-        new_end_tag = f"[/LEVEL {new_level}]"
-        item.setData(0, Qt.UserRole, (new_start_tag, new_end_tag))
-
-        for i in range(item.childCount()):
-            self.update_node_level(item.child(i), level_change)
-
     def evaluate_scene(self):
-        current_item = self.tree.currentItem()
-        if current_item:
-            start_tag, _ = current_item.data(0, Qt.UserRole)
-            level = int(start_tag[6:start_tag.index(']')])
-            if level == 5 or level == 6:
-                scene_content = current_item.data(0, Qt.UserRole + 1) or ""
-                if len(scene_content) >= 500:
-                    print(f"Evaluating scene: {current_item.text(0)}")
-                    evaluation = self.get_scene_evaluation(scene_content)
-                    if "error" in evaluation:
-                        print(f"Evaluation error: {evaluation['error']['comment']}")
-                    else:
-                        try:
-                            self.update_scene_evaluation_display(current_item, evaluation)
-                            print(f"Evaluation completed for {current_item.text(0)}")
-                        except Exception as e:
-                            print(f"Error updating scene evaluation display: {str(e)}")
-                            print(f"Evaluation data: {evaluation}")
+        current_node = self.current_node()
+        if current_node:
+            level = current_node.level
+            if is_scene_level(level):
+                scene_content = current_node.content or ""
+                if len(scene_content) >= MIN_SCENE_LENGTH:
+                    # Runs like Evaluate All, so backoff never blocks the
+                    # window and the progress dialog can cancel it.
+                    print(f"Evaluating scene: {current_node.title}")
+                    self.refresh_story_context()
+                    self.start_evaluation_run(
+                        [(current_node, scene_content)],
+                        lambda jobs, cancelled: evaluate_scenes(
+                            jobs, self.get_scene_evaluation, 1, cancelled,
+                            self.evaluation_runner.criterion_evaluated.emit
+                        ),
+                        'Evaluate Scene'
+                    )
                 else:
-                    print(f"Skipping scene {current_item.text(0)} (less than 500 characters)")
+                    print(f"Skipping scene {current_node.title} (less than {MIN_SCENE_LENGTH} characters)")
             else:
                 print(f"Level is {level}, please select a level 5 or 6 item (scene) to evaluate.")
         else:
             print("No item selected")
 
     def evaluate_all_scenes(self):
-        print("Starting evaluation of all scenes...")
-        root = self.tree.invisibleRootItem()
-        self.evaluate_tree_items(root)
-        print("Evaluation of all scenes completed.")
-
-    def evaluate_tree_items(self, parent_item: QTreeWidgetItem):
-        for i in range(parent_item.childCount()):
-            child = parent_item.child(i)
-            start_tag, _ = child.data(0, Qt.UserRole)
-            level = int(start_tag[6:start_tag.index(']')])
-            
-            if level == 5 or level == 6:
-                scene_content = child.data(0, Qt.UserRole + 1) or ""
-                if len(scene_content) >= 500:
-                    print(f"Evaluating scene: {child.text(0)}")
-                    evaluation = self.get_scene_evaluation(scene_content)
-                    if "error" in evaluation:
-                        print(f"Evaluation error for {child.text(0)}: {evaluation['error']['comment']}")
-                    else:
-                        try:
-                            self.update_scene_evaluation_display(child, evaluation)
-                            print(f"Evaluation completed for {child.text(0)}")
-                        except Exception as e:
-                            print(f"Error updating scene evaluation display for {child.text(0)}: {str(e)}")
-                            print(f"Evaluation data: {evaluation}")
-                else:
-                    print(f"Skipping scene {child.text(0)} (less than 500 characters)")
-            
-            self.evaluate_tree_items(child)
+        jobs = self.evaluate_tree_items(self.model.root)
+        print(f"Starting evaluation of {len(jobs)} scenes with concurrency {EVALUATION_CONCURRENCY}...")
+        self.start_evaluation_run(
+            jobs,
+            lambda jobs, cancelled: evaluate_scenes(
+                jobs, self.get_scene_evaluation, EVALUATION_CONCURRENCY, cancelled,
+                self.evaluation_runner.criterion_evaluated.emit
+            ),
+            'Evaluate All'
+        )
 
-    def get_scene_evaluation(self, scene_content: str) -> Dict[str, Any]:
-        prompt = self.create_evaluation_prompt(scene_content)
-        
-        message = client.messages.create(
-            model="claude-instant-1.2",
-            max_tokens=1000,
-            temperature=0,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        }
-                    ]
-                }
-            ]
+    def evaluate_all_scenes_chunked(self):
+        jobs = self.evaluate_tree_items(self.model.root)
+        print(f"Starting chunked evaluation of {len(jobs)} scenes with concurrency {EVALUATION_CONCURRENCY}...")
+        self.start_evaluation_run(
+            jobs,
+            lambda jobs, cancelled: evaluate_scenes(
+                jobs,
+                lambda scene_content, on_criterion, cancelled: self.get_scene_evaluation(
+                    scene_content, on_criterion, True, cancelled
+                ),
+                EVALUATION_CONCURRENCY, cancelled, self.evaluation_runner.criterion_evaluated.emit
+            ),
+            'Evaluate All (Chunked)'
         )
-        
-        if isinstance(message.content, list) and len(message.content) > 0 and hasattr(message.content[0], 'text'):
-            response_text = message.content[0].text
+
+    def evaluate_all_scenes_batch(self):
+        jobs = self.evaluate_tree_items(self.model.root)
+        print(f"Starting batch evaluation of {len(jobs)} scenes...")
+        self.start_evaluation_run(jobs, self.batch_evaluator.evaluate_jobs, 'Evaluate All (Batch)')
+
+    def resume_batch_evaluation(self):
+        # Only collects the stored batch; scenes it did not cover wait for
+        # the user to start a new run.
+        state = self.batch_evaluator.load_state()
+        if state:
+            print(f"Found unfinished evaluation batch {state['batch_id']}")
+            paths = self.batch_evaluator.state_paths(state)
+            jobs = [job for job in self.evaluate_tree_items(self.model.root) if job_path(job[0]) in paths]
+            self.start_evaluation_run(
+                jobs,
+                lambda jobs, cancelled: self.batch_evaluator.evaluate_jobs(jobs, cancelled, submit=False),
+                'Resume Batch'
+            )
+
+    def start_evaluation_run(self, jobs: List[Tuple[OutlineNode, str]], run_jobs, title: str):
+        if self.evaluation_runner:
+            print("An evaluation run is already in progress.")
+            return
+
+        self.evaluation_progress = QProgressDialog("Evaluating scenes...", "Cancel", 0, len(jobs), self)
+        self.evaluation_progress.setWindowTitle(title)
+        self.evaluation_progress.setMinimumDuration(0)
+        self.evaluation_progress.setAutoClose(False)
+        self.evaluation_progress.setAutoReset(False)
+        self.evaluation_progress.setValue(0)
+
+        self.evaluation_runner = EvaluationRunner(run_jobs, self)
+        self.evaluation_runner.scene_evaluated.connect(self.scene_evaluation_ready)
+        self.evaluation_runner.criterion_evaluated.connect(self.criterion_evaluation_ready)
+        self.evaluation_runner.scene_failed.connect(self.scene_evaluation_failed)
+        self.evaluation_runner.progress.connect(self.evaluation_progress_changed)
+        self.evaluation_runner.failed.connect(self.evaluation_run_failed)
+        self.evaluation_runner.finished.connect(self.evaluation_run_finished)
+        self.evaluation_progress.canceled.connect(self.evaluation_runner.cancel)
+        self.evaluation_progress.show()
+        self.evaluation_runner.start(jobs)
+
+    def evaluate_tree_items(self, parent_node: OutlineNode) -> List[Tuple[OutlineNode, str]]:
+        self.refresh_story_context()
+        return collect_scene_jobs(parent_node)
+
+    def refresh_story_context(self):
+        self.evaluator.story_context = build_story_outline(self.model.root)
+
+    def scene_evaluation_ready(self, node: OutlineNode, evaluation: Dict[str, Any]):
+        if "error" in evaluation:
+            self.scene_evaluation_failed(node, evaluation['error']['comment'])
+            return
+        try:
+            self.update_scene_evaluation_display(node, evaluation)
+            print(f"Evaluation completed for {node.title}")
+        except Exception as e:
+            self.model.clear_partial_evaluation(node)
+            print(f"Error updating scene evaluation display for {node.title}: {str(e)}")
+            print(f"Evaluation data: {evaluation}")
+
+    def criterion_evaluation_ready(self, node: OutlineNode, criterion: str, data: Dict[str, Any]):
+        # Streamed criteria are only displayed; the stored evaluation changes
+        # when the scene's final result arrives.
+        self.model.set_partial_criterion(node, criterion, data)
+
+    def scene_evaluation_failed(self, node: OutlineNode, error: str):
+        self.model.clear_partial_evaluation(node)
+        print(f"Evaluation error for {node.title}: {error}")
+
+    def evaluation_run_failed(self, error: str):
+        print(f"Evaluation run failed: {error}")
+
+    def evaluation_progress_changed(self, completed: int, total: int):
+        if self.evaluation_progress:
+            self.evaluation_progress.setValue(completed)
+            self.evaluation_progress.setLabelText(f"Evaluated {completed} of {total} scenes")
+
+    def evaluation_run_finished(self, cancelled: bool):
+        if self.evaluation_progress:
+            self.evaluation_progress.close()
+            self.evaluation_progress = None
+        runner, self.evaluation_runner = self.evaluation_runner, None
+        self.model.clear_partial_evaluations()
+        self.save_file_structure()
+        metrics.write_prometheus()
+        scenes = "the scene" if runner is not None and runner.total == 1 else "all scenes"
+        if runner is not None and runner.error is not None:
+            print(f"Evaluation of {scenes} stopped after an error.")
+        elif cancelled:
+            print(f"Evaluation of {scenes} cancelled.")
         else:
-            response_text = str(message.content)
+            print(f"Evaluation of {scenes} completed.")
 
+    def closeEvent(self, event):
+        if self.evaluation_runner:
+            self.evaluation_runner.cancel()
+        self.save_current_item_content()
+        self.watcher.close()
+        self.autosaver.close()
+        self.search_executor.shutdown(wait=False, cancel_futures=True)
         try:
-            evaluation = json.loads(response_text)
-            return evaluation
-        except json.JSONDecodeError:
-            return {
-                "error": {
-                    "score": 0,
-                    "comment": "Failed to parse evaluation response"
-                }
-            }
-
-    def update_scene_evaluation_display(self, item: QTreeWidgetItem, evaluation: Dict[str, Any]):
+            self.snapshot_store.compact()
+        except (OSError, ValueError) as e:
+            print(f"Could not compact snapshots: {e}")
+        metrics.write_prometheus()
+        metrics.close()
+        super().closeEvent(event)
+
+    def get_scene_evaluation(self, scene_content: str, on_criterion=None, chunked=None,
+                             cancelled=None) -> Dict[str, Any]:
+        return self.evaluator.evaluate(scene_content, on_criterion, chunked, cancelled)
+
+    def update_scene_evaluation_display(self, node: OutlineNode, evaluation: Dict[str, Any]):
         if evaluation:
             for criterion, data in evaluation.items():
-                score = data['score']
-                comment = data['comment']
-                color = self.get_color_for_score(score)
-                self.add_evaluation_pip(item, criterion, color, comment)
-            item.setData(0, Qt.UserRole + 2, evaluation)  # Store evaluation data
+                if 'score' not in data or 'comment' not in data:
+                    raise ValueError(f"Malformed evaluation for {criterion}")
+            self.model.set_evaluation(node, evaluation)  # Store evaluation data
 
     def create_evaluation_prompt(self, scene_content: str) -> str:
-        return f"""
-        Evaluate the following scene based on these criteria:
-        1. Dialogue
-        2. Hooks and Transitions
-        3. Theme/Subtext
-        4. Prose Quality
-        5. Relevance to Overall Story
-
-        For each criterion, provide a score from 1 to 5, where:
-        1 = Poor (Red)
-        2 = Fair (Orange)
-        3 = Good (Yellow)
-        4 = Very Good (Light Green)
-        5 = Excellent (Dark Green)
-
-        Scene content:
-        {scene_content}
-
-        Provide your evaluation as a JSON object with the following structure:
-        {{
-            "Dialogue": {{
-                "score": <int>,
-                "comment": <string>
-            }},
-            "Hooks_and_Transitions": {{
-                "score": <int>,
-                "comment": <string>
-            }},
-            "Theme_Subtext": {{
-                "score": <int>,
-                "comment": <string>
-            }},
-            "Prose_Quality": {{
-                "score": <int>,
-                "comment": <string>
-            }},
-            "Relevance_to_Overall_Story": {{
-                "score": <int>,
-                "comment": <string>
-            }}
-        }}
-        """
+        return create_evaluation_prompt(scene_content)
 
     def get_color_for_score(self, score: int) -> QColor:
-        colors = {
-            1: QColor(255, 0, 0),    # Red
-            2: QColor(255, 165, 0),  # Orange
-            3: QColor(255, 255, 0),  # Yellow
-            4: QColor(144, 238, 144),  # Light Green
-            5: QColor(0, 128, 0)     # Dark Green
-        }
-        return colors.get(score, QColor(0, 0, 0))  # Default to black if score is invalid
-
-    def add_evaluation_pip(self, item: QTreeWidgetItem, criterion: str, color: QColor, comment: str):
-        pip = QLabel()
-        pip.setFixedSize(10, 10)
-        pip.setStyleSheet(f"background-color: {color.name()}; border-radius: 5px;")
-        pip.setToolTip(f"{criterion}: {comment}")
-
-        layout = self.get_or_create_item_layout(item)
-        layout.addWidget(pip)
-
-        # Add rubric tooltip to the layout
-        if layout.count() == 2:  # Only add the tooltip label once
-            tooltip_label = QLabel("?")
-            tooltip_label.setToolTip(self.rubric_tooltip)
-            layout.addWidget(tooltip_label)
-
-    def get_or_create_item_layout(self, item: QTreeWidgetItem) -> QHBoxLayout:
-        widget = item.treeWidget().itemWidget(item, 0)
-        if not widget:
-            widget = QWidget()
-            layout = QHBoxLayout()
-            layout.setContentsMargins(0, 0, 0, 0)
-            layout.addWidget(QLabel(item.text(0)))
-            layout.addStretch()
-            widget.setLayout(layout)
-            item.treeWidget().setItemWidget(item, 0, widget)
-        else:
-            layout = widget.layout()
-
-        return layout
+        return color_for_score(score)
 
 def main():
     app = QApplication(sys.argv)
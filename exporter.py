@@ -0,0 +1,182 @@
+import html
+from typing import Any, Dict, Iterator, List, Optional
+
+from evaluation import EVALUATION_CRITERIA, is_scene_level
+from outline_parser import BODY, END, START, iter_file_lines, iter_outline_events
+
+
+def criterion_label(criterion: str) -> str:
+    return criterion.replace('_', ' ')
+
+
+def evaluation_scores(evaluation: Optional[Dict[str, Any]]) -> List[int]:
+    return [
+        data['score'] for criterion, data in (evaluation or {}).items()
+        if criterion in EVALUATION_CRITERIA and isinstance(data, dict) and isinstance(data.get('score'), int)
+    ]
+
+
+def mean_score(evaluation: Optional[Dict[str, Any]]) -> Optional[float]:
+    scores = evaluation_scores(evaluation)
+    return sum(scores) / len(scores) if scores else None
+
+
+def iter_criteria(evaluation: Dict[str, Any]) -> Iterator[tuple]:
+    for criterion, data in evaluation.items():
+        if criterion in EVALUATION_CRITERIA and isinstance(data, dict):
+            yield criterion_label(criterion), data.get('score'), data.get('comment', '')
+
+
+def paragraphs(content: str) -> List[str]:
+    return [paragraph.strip() for paragraph in content.split("\n\n") if paragraph.strip()]
+
+
+class MarkdownFormat:
+    extension = 'md'
+
+    def begin(self) -> str:
+        return ""
+
+    def heading(self, depth: int, title: str) -> str:
+        return f"{'#' * min(depth, 6)} {title}\n\n"
+
+    def body(self, content: str) -> str:
+        return "".join(f"{paragraph}\n\n" for paragraph in paragraphs(content))
+
+    def evaluation(self, evaluation: Dict[str, Any]) -> str:
+        lines = [f"> **Evaluation** (mean {mean_score(evaluation):.1f}/5)\n>\n"]
+        for label, score, comment in iter_criteria(evaluation):
+            lines.append(f"> - **{label}** ({score}/5): {comment}\n")
+        lines.append("\n")
+        return "".join(lines)
+
+    def end(self) -> str:
+        return ""
+
+
+class HtmlFormat:
+    extension = 'html'
+
+    def begin(self) -> str:
+        return ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+                '<style>.evaluation { color: #555; font-size: 90%; }</style>\n</head>\n<body>\n')
+
+    def heading(self, depth: int, title: str) -> str:
+        level = min(depth, 6)
+        return f"<h{level}>{html.escape(title)}</h{level}>\n"
+
+    def body(self, content: str) -> str:
+        return "".join(
+            f"<p>{html.escape(paragraph).replace(chr(10), '<br>')}</p>\n" for paragraph in paragraphs(content)
+        )
+
+    def evaluation(self, evaluation: Dict[str, Any]) -> str:
+        items = "".join(
+            f"<li><b>{html.escape(label)}</b> ({score}/5): {html.escape(str(comment))}</li>\n"
+            for label, score, comment in iter_criteria(evaluation)
+        )
+        return (f'<div class="evaluation"><p>Evaluation (mean {mean_score(evaluation):.1f}/5)</p>\n'
+                f"<ul>\n{items}</ul></div>\n")
+
+    def end(self) -> str:
+        return "</body>\n</html>\n"
+
+
+class TextFormat:
+    extension = 'txt'
+
+    def begin(self) -> str:
+        return ""
+
+    def heading(self, depth: int, title: str) -> str:
+        if depth == 1:
+            return f"{title.upper()}\n\n\n"
+        if depth == 2:
+            return f"{title}\n{'=' * len(title)}\n\n"
+        return f"{title}\n\n"
+
+    def body(self, content: str) -> str:
+        return "".join(f"{paragraph}\n\n" for paragraph in paragraphs(content))
+
+    def evaluation(self, evaluation: Dict[str, Any]) -> str:
+        lines = [f"[Evaluation: mean {mean_score(evaluation):.1f}/5]\n"]
+        for label, score, comment in iter_criteria(evaluation):
+            lines.append(f"[{label} {score}/5] {comment}\n")
+        lines.append("\n")
+        return "".join(lines)
+
+    def end(self) -> str:
+        return ""
+
+
+EXPORT_FORMATS = {
+    'markdown': MarkdownFormat,
+    'html': HtmlFormat,
+    'text': TextFormat,
+}
+
+
+def iter_export_chunks(filename: str, export_format: str = 'markdown', include_evaluations: bool = False,
+                       max_score: Optional[float] = None) -> Iterator[str]:
+    # Renders the outline file straight from the parser's event stream. Only
+    # the node being read and the headings above it are held in memory, so
+    # the size of the book does not matter. With `max_score`, only scenes
+    # whose mean score is below it are exported, under the headings that
+    # lead to them.
+    renderer = EXPORT_FORMATS[export_format]()
+    yield renderer.begin()
+
+    headings: List[Optional[tuple]] = []  # (depth, title), None once written
+    pending: Optional[list] = None  # [depth, title, content parts, evaluation]
+
+    def flush() -> Iterator[str]:
+        depth, title, parts, evaluation = pending
+        content = "\n".join(parts)
+        if max_score is not None:
+            if not is_scene_level(depth):
+                headings.append((depth, title))
+                return
+            score = mean_score(evaluation)
+            if score is None or score >= max_score:
+                headings.append(None)
+                return
+            for index, heading in enumerate(headings):
+                if heading is not None:
+                    yield renderer.heading(*heading)
+                    headings[index] = None
+            headings.append(None)
+        yield renderer.heading(depth, title)
+        if content:
+            yield renderer.body(content)
+        if include_evaluations and evaluation_scores(evaluation):
+            yield renderer.evaluation(evaluation)
+
+    depth = 0
+    for event in iter_outline_events(iter_file_lines(filename)):
+        kind = event[0]
+        if kind == START:
+            if pending:
+                yield from flush()
+                pending = None
+            depth += 1
+            pending = [depth, event[2], [], None]
+        elif kind == BODY:
+            if pending:
+                if event[1]:
+                    pending[2].append(event[1])
+                if event[2] is not None:
+                    pending[3] = event[2]
+            elif event[1] and max_score is None:
+                # Text after a node's children belongs to that node, but its
+                # heading is already out; it is written where it stands.
+                yield renderer.body(event[1])
+        elif kind == END and depth > 0:
+            if pending:
+                yield from flush()
+                pending = None
+            if max_score is not None and headings:
+                headings.pop()
+            depth -= 1
+    if pending:
+        yield from flush()
+    yield renderer.end()
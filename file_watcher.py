@@ -0,0 +1,82 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+
+from PyQt5.QtCore import QFileSystemWatcher, QObject, QTimer, pyqtSignal
+
+from metrics import metrics
+from outline_parser import parse_file
+
+WATCH_DELAY_MS = int(os.environ.get("EXPANSION_WATCH_DELAY_MS", "500"))
+
+
+def file_signature(filename: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class OutlineWatcher(QObject):
+    # Watches the outline file and its directory, since an atomic replace
+    # swaps the watched inode out. Bursts of events are debounced; a file
+    # whose signature matches `known()`, the one our own last save left
+    # behind, is ignored. Changed files are parsed on a background thread
+    # and the new tree is delivered through `changed`.
+    changed = pyqtSignal(object)
+
+    def __init__(self, filename: str, known: Callable[[], Optional[Tuple[int, int]]],
+                 delay_ms: int = WATCH_DELAY_MS, parent=None):
+        super().__init__(parent)
+        self.filename = os.path.abspath(filename)
+        self.known = known
+        self.seen: Optional[Tuple[int, int]] = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.schedule)
+        self.watcher.directoryChanged.connect(self.schedule)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay_ms)
+        self.timer.timeout.connect(self.check)
+
+    def watch(self):
+        self.seen = file_signature(self.filename)
+        directory = os.path.dirname(self.filename)
+        if directory not in self.watcher.directories():
+            self.watcher.addPath(directory)
+        self.rewatch()
+
+    def rewatch(self):
+        if self.filename not in self.watcher.files() and os.path.exists(self.filename):
+            self.watcher.addPath(self.filename)
+
+    def schedule(self, path: str):
+        self.timer.start()
+
+    def check(self):
+        self.rewatch()
+        signature = file_signature(self.filename)
+        if signature is None or signature == self.seen:
+            return
+        self.seen = signature
+        if signature == self.known():
+            return
+        self.executor.submit(self.parse, signature)
+
+    def parse(self, signature: Tuple[int, int]):
+        start = time.perf_counter()
+        try:
+            root = parse_file(self.filename)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Could not reload {self.filename}: {e}")
+            return
+        metrics.record_io('reload', time.perf_counter() - start, signature[1], self.filename)
+        self.changed.emit(root)
+
+    def close(self):
+        self.timer.stop()
+        self.watcher.removePaths(self.watcher.files() + self.watcher.directories())
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,98 @@
+import json
+from typing import Any, Callable, List, Optional
+
+STRING_END_FOLLOWERS = ',:}]'
+
+
+class MemberStreamParser:
+    # Incrementally scans a streamed JSON object and hands each top-level
+    # member to `on_member` as soon as its object or array value closes.
+    # Members are decoded one at a time, so a malformed member is dropped
+    # without losing the ones around it. Text before the first '{' (such
+    # as a code fence) is ignored.
+    #
+    # A quote inside a string only ends it when the next non-blank
+    # character could follow a JSON string; otherwise it is taken as an
+    # unescaped quote in the text and escaped before decoding.
+    def __init__(self, on_member: Callable[[str, Any], None]):
+        self.on_member = on_member
+        self.text = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.string_start = 0
+        self.key: Optional[str] = None
+        self.value_start = 0
+        self.stray_quotes: List[int] = []
+        self.done = False
+
+    def feed(self, chunk: str):
+        self.text += chunk
+        text = self.text
+        position = self.position
+        while position < len(text) and not self.done:
+            char = text[position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    follower = self.next_significant(position + 1)
+                    if follower is None:
+                        break
+                    if follower in STRING_END_FOLLOWERS:
+                        self.in_string = False
+                        if self.depth == 1:
+                            self.key = self.decode_key(text[self.string_start:position + 1])
+                    elif self.depth > 1:
+                        self.stray_quotes.append(position)
+            elif char == '"':
+                if self.depth > 0:
+                    self.in_string = True
+                    self.string_start = position
+            elif char in '{[':
+                if self.depth == 1:
+                    self.value_start = position
+                    self.stray_quotes = []
+                self.depth += 1
+            elif char in '}]' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 1:
+                    self.emit(position + 1)
+                elif self.depth == 0:
+                    self.done = True
+            position += 1
+        self.position = position
+
+    def next_significant(self, position: int) -> Optional[str]:
+        while position < len(self.text):
+            if not self.text[position].isspace():
+                return self.text[position]
+            position += 1
+        return None
+
+    @staticmethod
+    def decode_key(literal: str) -> Optional[str]:
+        try:
+            return json.loads(literal)
+        except json.JSONDecodeError:
+            return None
+
+    def emit(self, end: int):
+        key, self.key = self.key, None
+        if key is None:
+            return
+        parts = []
+        start = self.value_start
+        for quote in self.stray_quotes:
+            parts.append(self.text[start:quote])
+            parts.append('\\')
+            start = quote
+        parts.append(self.text[start:end])
+        try:
+            value = json.loads("".join(parts))
+        except json.JSONDecodeError:
+            return
+        self.on_member(key, value)
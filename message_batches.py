@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from evaluation import (
+    SceneEvaluator, build_request_params, get_batch_client, parse_error, parse_evaluation, record_response,
+    response_text, tag_evaluation
+)
+from outline_writer import write_atomic
+from scheduler import RETRY_STATUS, error_status
+
+BATCH_STATE_FILE = os.environ.get("EXPANSION_BATCH_STATE_FILE", ".evaluation_batch.json")
+BATCH_POLL_INTERVAL = float(os.environ.get("EXPANSION_BATCH_POLL_INTERVAL", "5"))
+BATCH_MAX_POLL_INTERVAL = 60.0
+
+
+def is_batch_gone(error: Exception) -> bool:
+    # Client errors other than timeouts, conflicts and rate limits mean the
+    # stored batch ID will never work again (expired, deleted or invalid).
+    status = error_status(error)
+    return status is not None and 400 <= status < 500 and status not in RETRY_STATUS
+
+
+def job_path(key: Any) -> str:
+    return "/".join(str(index) for index in key.path())
+
+
+class BatchEvaluator:
+    # The batch state records, for every custom_id, the tree paths of the
+    # scenes it stands for and the cache key of the content that was sent,
+    # together with the story outline of the run. Results are resolved
+    # through that record, so a batch picked up after a restart still finds
+    # its scenes when titles changed in between; a scene whose content no
+    # longer matches only gets its result cached. Batches use only the first
+    # model of the evaluator's cascade.
+    def __init__(self, evaluator: SceneEvaluator, state_file: str = BATCH_STATE_FILE,
+                 poll_interval: float = BATCH_POLL_INTERVAL,
+                 max_poll_interval: float = BATCH_MAX_POLL_INTERVAL):
+        self.evaluator = evaluator
+        self.state_file = state_file
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    def load_state(self) -> Optional[Dict[str, Any]]:
+        # A state file that cannot be used is dropped rather than retried on
+        # every launch.
+        if not os.path.exists(self.state_file):
+            return None
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Discarding unreadable batch state {self.state_file}: {e}")
+            self.clear_state()
+            return None
+        if (not isinstance(state, dict) or not isinstance(state.get('batch_id'), str)
+                or not isinstance(state.get('requests'), dict)):
+            print(f"Discarding invalid batch state {self.state_file}")
+            self.clear_state()
+            return None
+        return state
+
+    def save_state(self, state: Dict[str, Any]):
+        write_atomic([self.state_file], [json.dumps(state)])
+
+    def clear_state(self):
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+    def batch_key(self, scene_content: str, story_context: str) -> str:
+        return self.evaluator.cache_key(scene_content, model=self.evaluator.models[0], story_context=story_context)
+
+    def state_paths(self, state: Dict[str, Any]) -> Set[str]:
+        return {path for request in state['requests'].values() for path in request['paths']}
+
+    def submit(self, scenes: Dict[str, Tuple[str, List[str]]]) -> Dict[str, Any]:
+        # `scenes` maps cache keys to (scene content, tree paths).
+        story_context = self.evaluator.story_context
+        requests = {}
+        params = []
+        for number, (cache_key, (scene_content, paths)) in enumerate(scenes.items()):
+            custom_id = f"scene-{number}"
+            requests[custom_id] = {'cache_key': cache_key, 'paths': paths}
+            params.append({"custom_id": custom_id, "params": build_request_params(
+                scene_content, story_context, model=self.evaluator.models[0]
+            )})
+        batch = get_batch_client().messages.batches.create(requests=params)
+        state = {
+            'batch_id': batch.id,
+            'created': datetime.now().isoformat(),
+            'story_context': story_context,
+            'requests': requests
+        }
+        self.save_state(state)
+        print(f"Submitted batch {batch.id} with {len(scenes)} scenes")
+        return state
+
+    def wait(self, batch_id: str, cancelled: Optional[threading.Event] = None) -> bool:
+        cancelled = cancelled or threading.Event()
+        interval = self.poll_interval
+        while True:
+            batch = get_batch_client().messages.batches.retrieve(batch_id)
+            if batch.processing_status == 'ended':
+                return True
+            counts = batch.request_counts
+            print(f"Batch {batch_id}: {counts.processing} processing, {counts.succeeded} succeeded")
+            if cancelled.wait(interval):
+                return False
+            interval = min(interval * 1.5, self.max_poll_interval)
+
+    def collect(self, state: Dict[str, Any], cancelled: Optional[threading.Event] = None
+                ) -> Optional[Dict[str, Dict[str, Any]]]:
+        batch_id = state['batch_id']
+        if not self.wait(batch_id, cancelled):
+            return None
+        results = {}
+        for entry in get_batch_client().messages.batches.results(batch_id):
+            request = state['requests'].get(entry.custom_id)
+            if request is None:
+                continue
+            if entry.result.type == 'succeeded':
+                evaluation = tag_evaluation(
+                    parse_evaluation(response_text(entry.result.message)), self.evaluator.models[0], 1
+                )
+                record_response(entry.result.message, evaluation)
+                self.evaluator.store(request['cache_key'], evaluation)
+            else:
+                evaluation = parse_error(f"Batch request {entry.result.type}")
+            results[entry.custom_id] = evaluation
+        return results
+
+    def resolve(self, state: Dict[str, Any], collected: Dict[str, Dict[str, Any]],
+                jobs: Dict[str, Tuple[Any, str]]
+                ) -> Iterator[Tuple[Any, Optional[Dict[str, Any]], Optional[str]]]:
+        # Yields results for the jobs at the recorded paths whose content is
+        # still what was sent, removing them from `jobs`.
+        for custom_id, request in state['requests'].items():
+            evaluation = collected.get(custom_id)
+            for path in request['paths']:
+                job = jobs.get(path)
+                if job is None or self.batch_key(job[1], state['story_context']) != request['cache_key']:
+                    continue
+                del jobs[path]
+                if evaluation is None:
+                    yield job[0], None, "Scene missing from batch results"
+                elif "error" in evaluation:
+                    yield job[0], None, evaluation['error']['comment']
+                else:
+                    yield job[0], evaluation, None
+
+    def evaluate_jobs(self, jobs: List[Tuple[Any, str]], cancelled: Optional[threading.Event] = None,
+                      submit: bool = True) -> Iterator[Tuple[Any, Optional[Dict[str, Any]], Optional[str]]]:
+        # Same (key, evaluation, error) protocol as evaluation.evaluate_scenes;
+        # keys are outline nodes. A stored batch is collected first. Without
+        # `submit`, that is all: no new batch is sent for the remaining
+        # scenes. Cancelling stops polling but keeps the batch for later.
+        remaining = {job_path(key): (key, scene_content) for key, scene_content in jobs}
+        state = self.load_state()
+        if state:
+            print(f"Resuming batch {state['batch_id']}")
+            try:
+                collected = self.collect(state, cancelled)
+            except Exception as e:
+                if not is_batch_gone(e):
+                    raise
+                print(f"Batch {state['batch_id']} is no longer available: {e}")
+                collected = {}
+            if collected is None:
+                return
+            yield from self.resolve(state, collected, remaining)
+            self.clear_state()
+        if not submit:
+            return
+
+        scenes: Dict[str, Tuple[str, List[str]]] = {}
+        for path, (key, scene_content) in list(remaining.items()):
+            cache_key = self.batch_key(scene_content, self.evaluator.story_context)
+            evaluation = self.evaluator.cached(cache_key)
+            if evaluation is not None:
+                del remaining[path]
+                yield key, evaluation, None
+            else:
+                scenes.setdefault(cache_key, (scene_content, []))[1].append(path)
+        if not scenes:
+            return
+
+        state = self.submit(scenes)
+        collected = self.collect(state, cancelled)
+        if collected is None:
+            return
+        yield from self.resolve(state, collected, remaining)
+        self.clear_state()
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from outline_writer import write_atomic
+
+METRICS_EVENTS_FILE = os.environ.get("EXPANSION_METRICS_FILE", ".expansion_metrics.jsonl")
+METRICS_PROMETHEUS_FILE = os.environ.get("EXPANSION_PROMETHEUS_FILE", ".expansion_metrics.prom")
+# The event log is rotated to `<file>.1` once it passes this size, so at most
+# twice this much is kept on disk; 0 lets it grow without limit.
+METRICS_EVENTS_MAX_BYTES = int(os.environ.get("EXPANSION_METRICS_MAX_BYTES", str(10 * 1024 * 1024)))
+METRICS_PREFIX = "expansion_"
+SAMPLE_WINDOW = 1000
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Summary:
+    __slots__ = ('count', 'total', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples: Deque[float] = deque(maxlen=SAMPLE_WINDOW)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Metrics:
+    # Counters and summaries are kept in memory for the summary panel and the
+    # Prometheus export; every recorded event is also appended as a JSON line.
+    def __init__(self, events_file: Optional[str] = METRICS_EVENTS_FILE,
+                 events_max_bytes: int = METRICS_EVENTS_MAX_BYTES):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.summaries: Dict[str, Summary] = {}
+        self.events_file = events_file
+        self.events_max_bytes = events_max_bytes
+        self.events = None
+
+    def increment(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self.lock:
+            summary = self.summaries.get(name)
+            if summary is None:
+                summary = self.summaries[name] = Summary()
+            summary.observe(value)
+
+    def event(self, kind: str, **fields: Any):
+        if not self.events_file:
+            return
+        record = {'time': time.time(), 'event': kind}
+        record.update(fields)
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            if self.events is None:
+                self.events = open(self.events_file, 'a', encoding='utf-8')
+            self.events.write(line)
+            self.events.flush()
+            if self.events_max_bytes and self.events.tell() >= self.events_max_bytes:
+                self.rotate_events()
+
+    def rotate_events(self):
+        self.events.close()
+        self.events = None
+        try:
+            os.replace(self.events_file, self.events_file + ".1")
+        except OSError as e:
+            print(f"Could not rotate {self.events_file}: {e}")
+
+    def record_usage(self, usage):
+        if usage is None:
+            return
+        for field in ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens'):
+            value = getattr(usage, field, None)
+            if value:
+                self.increment(field, value)
+
+    def record_io(self, operation: str, seconds: float, size: int, filename: str):
+        self.observe(f"{operation}_seconds", seconds)
+        self.increment(f"{operation}_bytes", size)
+        self.event(operation, seconds=seconds, bytes=size, filename=filename)
+
+    def prometheus_text(self) -> str:
+        lines: List[str] = []
+        with self.lock:
+            for name in sorted(self.counters):
+                metric = f"{METRICS_PREFIX}{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {self.counters[name]}")
+            for name in sorted(self.summaries):
+                summary = self.summaries[name]
+                metric = f"{METRICS_PREFIX}{name}"
+                lines.append(f"# TYPE {metric} summary")
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{quantile="{q}"}} {summary.quantile(q)}')
+                lines.append(f"{metric}_sum {summary.total}")
+                lines.append(f"{metric}_count {summary.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, filename: Optional[str] = METRICS_PROMETHEUS_FILE):
+        if filename:
+            write_atomic([filename], [self.prometheus_text()])
+
+    def summary_text(self) -> str:
+        lines: List[str] = []
+        with self.lock:
+            for name in sorted(self.counters):
+                lines.append(f"{name}: {self.counters[name]:g}")
+            for name in sorted(self.summaries):
+                summary = self.summaries[name]
+                mean = summary.total / summary.count if summary.count else 0.0
+                lines.append(
+                    f"{name}: n={summary.count} mean={mean:.3f} "
+                    f"p50={summary.quantile(0.5):.3f} p90={summary.quantile(0.9):.3f} "
+                    f"p99={summary.quantile(0.99):.3f}"
+                )
+        return "\n".join(lines) or "No metrics recorded yet."
+
+    def close(self):
+        with self.lock:
+            if self.events:
+                self.events.close()
+                self.events = None
+
+
+metrics = Metrics()
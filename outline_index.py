@@ -0,0 +1,289 @@
+import hashlib
+import json
+import mmap
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from outline_parser import BODY, OutlineNode, iter_outline_events, parse_level_tag
+from outline_writer import Record, format_end_tag, format_node_body, iter_node_records, write_atomic
+
+INDEX_SUFFIX = os.environ.get("EXPANSION_INDEX_SUFFIX", ".idx")
+INDEX_VERSION = 1
+COPY_CHUNK_SIZE = 1 << 20
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def child_path(parent: Optional['IndexEntry'], row: int) -> str:
+    return f"{parent.path}/{row}" if parent is not None else str(row)
+
+
+def parse_body(data: bytes) -> Tuple[str, Optional[Dict[str, Any]]]:
+    # The bytes between a node's header and the next tag hold its content
+    # and [EVALUATION] line; they are read with the parser's own rules.
+    for event in iter_outline_events(data.decode('utf-8').splitlines()):
+        if event[0] == BODY:
+            return event[1], event[2]
+    return "", None
+
+
+class IndexEntry:
+    # Byte ranges of one node in the outline file: `start` is its header
+    # line, [body_start, body_end) its content and evaluation, and `end`
+    # follows its closing tag. Text after a node's children is not covered;
+    # the writer never produces any.
+    __slots__ = ('path', 'title', 'start', 'body_start', 'body_end', 'end', 'content_hash', 'has_evaluation')
+
+    def __init__(self, path: str, title: str, start: int, body_start: int, body_end: int = 0, end: int = 0,
+                 content_hash: str = "", has_evaluation: bool = False):
+        self.path = path
+        self.title = title
+        self.start = start
+        self.body_start = body_start
+        self.body_end = body_end
+        self.end = end
+        self.content_hash = content_hash
+        self.has_evaluation = has_evaluation
+
+    def to_json(self) -> list:
+        return [self.path, self.title, self.start, self.body_start, self.body_end, self.end,
+                self.content_hash, self.has_evaluation]
+
+    @classmethod
+    def from_json(cls, data: list) -> 'IndexEntry':
+        return cls(*data)
+
+    def shift(self, after: int, delta: int):
+        self.start += delta if self.start >= after else 0
+        self.body_start += delta if self.body_start >= after else 0
+        self.body_end += delta if self.body_end >= after else 0
+        self.end += delta if self.end >= after else 0
+
+
+def iter_indexed_chunks(records: Iterable[Record], entries: List[IndexEntry]) -> Iterator[str]:
+    # Same output as outline_writer.iter_record_chunks, recording an entry
+    # for every node as its bytes go out.
+    open_entries: List[Tuple[int, IndexEntry]] = []
+    counts = [0]
+    offset = 0
+    for depth, level, title, content, evaluation in records:
+        while len(open_entries) >= depth:
+            closing_level, entry = open_entries.pop()
+            counts.pop()
+            chunk = format_end_tag(closing_level)
+            offset += len(chunk.encode('utf-8'))
+            entry.end = offset
+            yield chunk
+        content = content or ""
+        header = f"[LEVEL {level}]{title}\n"
+        body = format_node_body(content, evaluation)
+        path = child_path(open_entries[-1][1] if open_entries else None, counts[-1])
+        counts[-1] += 1
+        counts.append(0)
+        start = offset
+        offset += len(header.encode('utf-8'))
+        body_start = offset
+        offset += len(body.encode('utf-8'))
+        entry = IndexEntry(path, title, start, body_start, offset, 0, content_hash(content), bool(evaluation))
+        entries.append(entry)
+        open_entries.append((level, entry))
+        yield header + body
+    while open_entries:
+        closing_level, entry = open_entries.pop()
+        chunk = format_end_tag(closing_level)
+        offset += len(chunk.encode('utf-8'))
+        entry.end = offset
+        yield chunk
+
+
+def scan_entries(mapped) -> List[IndexEntry]:
+    # Rebuilds the entries from the file itself, following the same tag
+    # rules as outline_parser.iter_outline_events.
+    entries: List[IndexEntry] = []
+    open_entries: List[IndexEntry] = []
+    counts = [0]
+    body: Optional[IndexEntry] = None
+
+    def close_body(position: int):
+        body.body_end = position
+        content, evaluation = parse_body(mapped[body.body_start:position])
+        body.content_hash = content_hash(content)
+        body.has_evaluation = bool(evaluation)
+
+    size = len(mapped)
+    position = 0
+    while position < size:
+        newline = mapped.find(b'\n', position)
+        line_end = size if newline < 0 else newline + 1
+        line = mapped[position:line_end].strip()
+        if line.startswith(b'[LEVEL') and b']' in line:
+            if body is not None:
+                close_body(position)
+                body = None
+            try:
+                _, title = parse_level_tag(line.decode('utf-8'))
+            except ValueError:
+                position = line_end
+                continue
+            entry = IndexEntry(child_path(open_entries[-1] if open_entries else None, counts[-1]),
+                               title, position, line_end)
+            counts[-1] += 1
+            counts.append(0)
+            entries.append(entry)
+            open_entries.append(entry)
+            body = entry
+        elif line.startswith(b'[/LEVEL'):
+            if body is not None:
+                close_body(position)
+                body = None
+            if open_entries:
+                open_entries.pop().end = line_end
+                counts.pop()
+        position = line_end
+    if body is not None:
+        close_body(size)
+    for entry in open_entries:
+        entry.end = size
+    return entries
+
+
+class OutlineIndex:
+    # Sidecar index of an outline file, stored next to it, mapping node
+    # paths (as in the CLI's JSONL output, e.g. "0/3/2") to byte ranges, a
+    # hash of the content and whether the node carries an evaluation. It
+    # records the outline's mtime and size and is rebuilt from the file
+    # whenever those no longer match, so single nodes can be read and
+    # patched through mmap without parsing the whole outline.
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.index_filename = filename + INDEX_SUFFIX
+        self.entries: List[IndexEntry] = []
+        self.paths: Dict[str, IndexEntry] = {}
+        self.signature: Optional[Tuple[int, int]] = None
+
+    def outline_signature(self) -> Tuple[int, int]:
+        stat = os.stat(self.filename)
+        return stat.st_mtime_ns, stat.st_size
+
+    def set_entries(self, entries: List[IndexEntry]):
+        self.entries = entries
+        self.paths = {entry.path: entry for entry in entries}
+
+    def load(self) -> bool:
+        try:
+            with open(self.index_filename, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('version') != INDEX_VERSION:
+                return False
+            signature = (data['mtime_ns'], data['size'])
+            if signature != self.outline_signature():
+                return False
+            self.set_entries([IndexEntry.from_json(item) for item in data['nodes']])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        self.signature = signature
+        return True
+
+    def save(self):
+        self.signature = self.outline_signature()
+        data = {
+            "version": INDEX_VERSION,
+            "mtime_ns": self.signature[0],
+            "size": self.signature[1],
+            "nodes": [entry.to_json() for entry in self.entries]
+        }
+        write_atomic([self.index_filename], [json.dumps(data, separators=(',', ':'))])
+
+    def build(self):
+        with open(self.filename, 'rb') as file:
+            try:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                entries = []
+            else:
+                with mapped:
+                    entries = scan_entries(mapped)
+        self.set_entries(entries)
+        self.save()
+        print(f"Rebuilt outline index: {self.index_filename} ({len(entries)} nodes)")
+
+    def ensure(self) -> 'OutlineIndex':
+        if self.signature is None or self.signature != self.outline_signature():
+            if not self.load():
+                self.build()
+        return self
+
+    def entry(self, path: str) -> IndexEntry:
+        self.ensure()
+        entry = self.paths.get(path)
+        if entry is None:
+            raise KeyError(f"No node at path {path!r} in {self.filename}")
+        return entry
+
+    def read_node(self, path: str) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+        entry = self.entry(path)
+        with open(self.filename, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            content, evaluation = parse_body(mapped[entry.body_start:entry.body_end])
+        return entry.title, content, evaluation
+
+    def outline_titles(self) -> OutlineNode:
+        # A title-only tree, enough for evaluation.build_story_outline.
+        self.ensure()
+        root = OutlineNode()
+        nodes = {"": root}
+        for entry in self.entries:
+            node = OutlineNode(entry.title)
+            nodes[entry.path.rpartition('/')[0]].children.append(node)
+            nodes[entry.path] = node
+        return root
+
+    def patch_content(self, path: str, content: str):
+        _, _, evaluation = self.read_node(path)
+        self.patch_body(self.entry(path), content, evaluation)
+
+    def patch_evaluation(self, path: str, evaluation: Optional[Dict[str, Any]]):
+        _, content, _ = self.read_node(path)
+        self.patch_body(self.entry(path), content, evaluation)
+
+    def patch_body(self, entry: IndexEntry, content: str, evaluation: Optional[Dict[str, Any]]):
+        # A body of the same length is overwritten in the mapping. Otherwise
+        # the file is rewritten atomically from the mapping around the new
+        # body, and the offsets after it are shifted without rescanning.
+        data = format_node_body(content, evaluation).encode('utf-8')
+        start, end = entry.body_start, entry.body_end
+        if len(data) == end - start:
+            with open(self.filename, 'r+b') as file, mmap.mmap(file.fileno(), 0) as mapped:
+                mapped[start:end] = data
+                mapped.flush()
+        else:
+            with open(self.filename, 'rb') as file, \
+                    mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                write_atomic([self.filename], self.iter_spliced(mapped, start, end, data))
+            delta = len(data) - (end - start)
+            for other in self.entries:
+                other.shift(end, delta)
+            entry.body_end = start + len(data)
+        entry.content_hash = content_hash(content)
+        entry.has_evaluation = bool(evaluation)
+        self.save()
+
+    @staticmethod
+    def iter_spliced(mapped, start: int, end: int, data: bytes) -> Iterator[bytes]:
+        for position in range(0, start, COPY_CHUNK_SIZE):
+            yield mapped[position:min(position + COPY_CHUNK_SIZE, start)]
+        yield data
+        for position in range(end, len(mapped), COPY_CHUNK_SIZE):
+            yield mapped[position:position + COPY_CHUNK_SIZE]
+
+
+def write_indexed_outline(root, filename: str) -> int:
+    # Writes the outline and its sidecar index in one pass over the tree.
+    entries: List[IndexEntry] = []
+    size = write_atomic([filename], iter_indexed_chunks(iter_node_records(root), entries))
+    index = OutlineIndex(filename)
+    index.set_entries(entries)
+    index.save()
+    return size
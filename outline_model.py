@@ -0,0 +1,288 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt
+
+from document import DocNode, align_children, is_attached
+from outline_parser import OutlineNode
+
+TAGS_ROLE = Qt.UserRole
+CONTENT_ROLE = Qt.UserRole + 1
+EVALUATION_ROLE = Qt.UserRole + 2
+
+FETCH_BATCH_SIZE = 256
+
+
+class OutlineModel(QAbstractItemModel):
+    # Rows are exposed to the view in batches through canFetchMore/fetchMore,
+    # so only the parts of the outline the user has expanded are laid out.
+    # Criteria streamed in during an evaluation are held in `partial` and
+    # shown instead of the stored evaluation until the final result
+    # replaces it, or the attempt fails and the stored one shows again.
+    def __init__(self, root: Optional[OutlineNode] = None, parent=None):
+        super().__init__(parent)
+        self.root = root or OutlineNode()
+        self.fetched: Dict[OutlineNode, int] = {}
+        self.partial: Dict[OutlineNode, Dict[str, Any]] = {}
+
+    def set_root(self, root: OutlineNode):
+        self.beginResetModel()
+        self.root = root
+        self.fetched = {}
+        self.partial = {}
+        self.endResetModel()
+
+    def rebuild(self, update: Callable[[], Any]) -> Any:
+        # For changes too scattered for row signals, such as an undo; the
+        # view re-fetches whatever is expanded afterwards.
+        self.beginResetModel()
+        try:
+            return update()
+        finally:
+            self.fetched = {}
+            self.endResetModel()
+
+    def node_from_index(self, index: QModelIndex) -> OutlineNode:
+        if index.isValid():
+            return index.internalPointer()
+        return self.root
+
+    def in_tree(self, node: OutlineNode) -> bool:
+        # Subtrees dropped by an undo or a merge hang off an unparented node,
+        # and a worker may still report on them.
+        while node.parent is not None:
+            node = node.parent
+        return node is self.root
+
+    def index_for_node(self, node: OutlineNode, fetch: bool = True) -> QModelIndex:
+        if node is None or node is self.root or not self.in_tree(node):
+            return QModelIndex()
+        row = node.row()
+        if fetch:
+            self.ensure_fetched(node.parent, row + 1)
+        elif row >= self.fetched.get(node.parent, 0) or (
+                node.parent is not self.root and not self.index_for_node(node.parent, False).isValid()):
+            return QModelIndex()
+        return self.createIndex(row, 0, node)
+
+    def ensure_fetched(self, node: OutlineNode, count: int):
+        fetched = self.fetched.get(node, 0)
+        count = min(count, len(node.children))
+        if count > fetched:
+            parent_index = self.index_for_node(node)
+            self.beginInsertRows(parent_index, fetched, count - 1)
+            self.fetched[node] = count
+            self.endInsertRows()
+
+    def index(self, row: int, column: int, parent: QModelIndex = QModelIndex()) -> QModelIndex:
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        return self.createIndex(row, column, self.node_from_index(parent).children[row])
+
+    def parent(self, index: QModelIndex) -> QModelIndex:
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self.root:
+            return QModelIndex()
+        return self.createIndex(parent.row(), 0, parent)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.column() > 0:
+            return 0
+        return self.fetched.get(self.node_from_index(parent), 0)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 1
+
+    def hasChildren(self, parent: QModelIndex = QModelIndex()) -> bool:
+        return bool(self.node_from_index(parent).children)
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        node = self.node_from_index(parent)
+        return self.fetched.get(node, 0) < len(node.children)
+
+    def fetchMore(self, parent: QModelIndex):
+        node = self.node_from_index(parent)
+        self.ensure_fetched(node, self.fetched.get(node, 0) + FETCH_BATCH_SIZE)
+
+    def flags(self, index: QModelIndex):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def headerData(self, section: int, orientation, role: int = Qt.DisplayRole) -> Any:
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return 'Outline'
+        return None
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if role == Qt.DisplayRole:
+            return node.title
+        if role == TAGS_ROLE:
+            return (f"[LEVEL {node.level}]{node.title}", f"[/LEVEL {node.level}]")
+        if role == CONTENT_ROLE:
+            return node.content
+        if role == EVALUATION_ROLE:
+            return self.partial.get(node) or node.evaluation
+        return None
+
+    def setData(self, index: QModelIndex, value: Any, role: int = Qt.EditRole) -> bool:
+        if not index.isValid():
+            return False
+        node = index.internalPointer()
+        if role == CONTENT_ROLE:
+            node.content = value or ""
+        elif role == EVALUATION_ROLE:
+            node.evaluation = value
+        else:
+            return False
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def set_evaluation(self, node: OutlineNode, evaluation: Optional[Dict[str, Any]]):
+        node.evaluation = evaluation
+        self.partial.pop(node, None)
+        self.evaluation_changed(node)
+
+    def evaluation_changed(self, node: OutlineNode):
+        index = self.index_for_node(node, fetch=False)
+        if index.isValid():
+            self.dataChanged.emit(index, index, [EVALUATION_ROLE])
+
+    def set_partial_criterion(self, node: OutlineNode, criterion: str, data: Dict[str, Any]):
+        self.partial.setdefault(node, {})[criterion] = data
+        self.evaluation_changed(node)
+
+    def clear_partial_evaluation(self, node: OutlineNode):
+        if self.partial.pop(node, None) is not None:
+            self.evaluation_changed(node)
+
+    def clear_partial_evaluations(self):
+        for node in list(self.partial):
+            self.clear_partial_evaluation(node)
+
+    def insert_node(self, parent: OutlineNode, row: int, node: OutlineNode):
+        self.ensure_fetched(parent, row)
+        self.beginInsertRows(self.index_for_node(parent), row, row)
+        parent.insert_child(row, node)
+        self.fetched[parent] = self.fetched.get(parent, 0) + 1
+        self.endInsertRows()
+
+    def move_node(self, node: OutlineNode, new_parent: OutlineNode, new_row: int):
+        old_parent = node.parent
+        old_row = node.row()
+        self.ensure_fetched(old_parent, old_row + 1)
+        self.ensure_fetched(new_parent, new_row + 1 if new_parent is old_parent else new_row)
+
+        destination = new_row + 1 if new_parent is old_parent and new_row > old_row else new_row
+        self.beginMoveRows(self.index_for_node(old_parent), old_row, old_row,
+                           self.index_for_node(new_parent), destination)
+        old_parent.take_child(old_row)
+        self.fetched[old_parent] -= 1
+        new_parent.insert_child(new_row, node)
+        self.fetched[new_parent] = self.fetched.get(new_parent, 0) + 1
+        self.endMoveRows()
+
+    def remove_node(self, node: OutlineNode):
+        parent = node.parent
+        row = node.row()
+        fetched = self.fetched.get(parent, 0)
+        if row < fetched:
+            self.beginRemoveRows(self.index_for_node(parent), row, row)
+            parent.take_child(row)
+            self.fetched[parent] = fetched - 1
+            self.endRemoveRows()
+        else:
+            parent.take_child(row)
+        self.fetched.pop(node, None)
+        for descendant in node.iter_nodes():
+            self.fetched.pop(descendant, None)
+
+    def adopt_node(self, parent: OutlineNode, row: int, node: OutlineNode):
+        # Rows past what the view has fetched are not exposed yet, so they
+        # are inserted without signals instead of forcing a fetch.
+        if row <= self.fetched.get(parent, -1):
+            self.insert_node(parent, row, node)
+            return
+        had_children = bool(parent.children)
+        parent.insert_child(row, node)
+        if not had_children:
+            index = self.index_for_node(parent, fetch=False)
+            if index.isValid():
+                self.dataChanged.emit(index, index)
+
+    def merge(self, base: DocNode, theirs: OutlineNode) -> Tuple[List[OutlineNode], List[OutlineNode]]:
+        # Applies the difference between `base`, the document as it was last
+        # read or written, and `theirs`, a fresh parse of the file, to the
+        # live nodes `base` was taken from. Identical subtrees are left
+        # alone, so their evaluations and local edits elsewhere survive, and
+        # nodes deleted locally are not brought back. Reordered children are
+        # moved rather than removed and re-added. Returns the nodes that were
+        # rewritten or added and the nodes that were removed.
+        changed: List[OutlineNode] = []
+        detached: List[OutlineNode] = []
+        stack = [(base, theirs)]
+        while stack:
+            doc, other = stack.pop()
+            node = doc.node
+            fields_changed = (doc.title != other.title or doc.content != other.content
+                              or doc.evaluation != other.evaluation)
+            pairs = align_children(doc.children, other.children)
+            structure_changed = any(child_doc is None or child is None or moved for child_doc, child, moved in pairs)
+            if (fields_changed or structure_changed) and not is_attached(node, self.root):
+                continue
+
+            if fields_changed:
+                roles = []
+                if doc.title != other.title:
+                    node.title = other.title
+                    roles.append(Qt.DisplayRole)
+                if doc.content != other.content:
+                    node.content = other.content
+                    roles.append(CONTENT_ROLE)
+                if doc.evaluation != other.evaluation:
+                    node.evaluation = other.evaluation
+                    roles.append(EVALUATION_ROLE)
+                changed.append(node)
+                index = self.index_for_node(node, fetch=False)
+                if index.isValid():
+                    self.dataChanged.emit(index, index, roles)
+
+            anchor = None
+            for child_doc, child, moved in pairs:
+                if moved:
+                    # A reordered child is moved after the same anchor,
+                    # keeping its live node, evaluation and subtree.
+                    live = child_doc.node
+                    if live.parent is node:
+                        row = live.row()
+                        if anchor in node.children:
+                            target = node.children.index(anchor)
+                            target += 1 if row > target else 0
+                        else:
+                            target = len(node.children) - 1 if anchor is not None else 0
+                        if target != row:
+                            self.move_node(live, node, target)
+                        stack.append((child_doc, child))
+                        anchor = live
+                elif child_doc is None:
+                    # Added children go after the live node of the sibling
+                    # that precedes them in the file.
+                    row = node.children.index(anchor) + 1 if anchor in node.children else (
+                        len(node.children) if anchor is not None else 0)
+                    self.adopt_node(node, row, child)
+                    changed.append(child)
+                    changed.extend(child.iter_nodes())
+                    anchor = child
+                elif child is None:
+                    if child_doc.node.parent is node:
+                        detached.append(child_doc.node)
+                        detached.extend(child_doc.node.iter_nodes())
+                        self.remove_node(child_doc.node)
+                else:
+                    stack.append((child_doc, child))
+                    anchor = child_doc.node
+        return changed, detached
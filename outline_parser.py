@@ -0,0 +1,199 @@
+import json
+import mmap
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+START = 'start'
+BODY = 'body'
+END = 'end'
+
+
+class OutlineNode:
+    # The live, editable tree behind the view. A node's level is its depth,
+    # so moving a subtree never rewrites its descendants. `doc` caches the
+    # node's immutable document.DocNode snapshot; every change clears it on
+    # the node and its ancestors, so a new snapshot only rebuilds that path.
+    __slots__ = ('_title', '_content', '_evaluation', 'children', 'parent', 'doc')
+
+    def __init__(self, title: str = "", content: str = "",
+                 evaluation: Optional[Dict[str, Any]] = None):
+        self._title = title
+        self._content = content
+        self._evaluation = evaluation
+        self.children: List['OutlineNode'] = []
+        self.parent: Optional['OutlineNode'] = None
+        self.doc = None
+
+    def __repr__(self) -> str:
+        return f"OutlineNode(level={self.level}, title={self.title!r}, children={len(self.children)})"
+
+    @property
+    def title(self) -> str:
+        return self._title
+
+    @title.setter
+    def title(self, title: str):
+        self._title = title
+        self.touch()
+
+    @property
+    def content(self) -> str:
+        return self._content
+
+    @content.setter
+    def content(self, content: str):
+        self._content = content
+        self.touch()
+
+    @property
+    def evaluation(self) -> Optional[Dict[str, Any]]:
+        return self._evaluation
+
+    @evaluation.setter
+    def evaluation(self, evaluation: Optional[Dict[str, Any]]):
+        self._evaluation = evaluation
+        self.touch()
+
+    @property
+    def level(self) -> int:
+        level = 0
+        node = self.parent
+        while node is not None:
+            level += 1
+            node = node.parent
+        return level
+
+    def touch(self):
+        # A node without a cached snapshot has none above it either.
+        node = self
+        while node is not None and node.doc is not None:
+            node.doc = None
+            node = node.parent
+
+    def add_child(self, node: 'OutlineNode'):
+        node.parent = self
+        self.children.append(node)
+        self.touch()
+
+    def insert_child(self, index: int, node: 'OutlineNode'):
+        node.parent = self
+        self.children.insert(index, node)
+        self.touch()
+
+    def take_child(self, index: int) -> 'OutlineNode':
+        node = self.children.pop(index)
+        node.parent = None
+        self.touch()
+        return node
+
+    def row(self) -> int:
+        if self.parent is None:
+            return 0
+        return self.parent.children.index(self)
+
+    def path(self) -> Tuple[int, ...]:
+        path = []
+        node = self
+        while node.parent is not None:
+            path.append(node.row())
+            node = node.parent
+        return tuple(reversed(path))
+
+    def node_at(self, path: Iterable[int]) -> 'OutlineNode':
+        node = self
+        for index in path:
+            node = node.children[index]
+        return node
+
+    def iter_nodes(self) -> Iterator['OutlineNode']:
+        stack = list(reversed(self.children))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+
+def parse_level_tag(line: str) -> Tuple[int, str]:
+    close = line.index(']')
+    return int(line[6:close]), line[close + 1:].strip()
+
+
+def iter_outline_events(lines: Iterable[str]) -> Iterator[Tuple]:
+    # Yields (START, level, title), (BODY, content, evaluation) and (END, level)
+    # events in file order. BODY always refers to the innermost open node.
+    content_lines: List[str] = []
+    evaluation = None
+    depth = 0
+
+    for line in lines:
+        line = line.strip()
+        if line.startswith('[LEVEL') and ']' in line:
+            if content_lines or evaluation is not None:
+                yield (BODY, "\n".join(content_lines).strip(), evaluation)
+                content_lines = []
+                evaluation = None
+            try:
+                level, title = parse_level_tag(line)
+            except ValueError:
+                print(f"Skipping invalid line: {line}")
+                continue
+            depth += 1
+            yield (START, level, title)
+        elif line.startswith('[/LEVEL'):
+            if content_lines or evaluation is not None:
+                yield (BODY, "\n".join(content_lines).strip(), evaluation)
+                content_lines = []
+                evaluation = None
+            if depth > 0:
+                depth -= 1
+                try:
+                    level = int(line[7:line.index(']')])
+                except ValueError:
+                    level = 0
+                yield (END, level)
+        elif line.startswith('[EVALUATION]'):
+            try:
+                evaluation = json.loads(line[12:])
+            except json.JSONDecodeError:
+                print(f"Skipping invalid evaluation: {line[:80]}")
+        else:
+            content_lines.append(line)
+
+    if content_lines or evaluation is not None:
+        yield (BODY, "\n".join(content_lines).strip(), evaluation)
+
+
+def parse_lines(lines: Iterable[str]) -> OutlineNode:
+    root = OutlineNode()
+    stack = [root]
+    for event in iter_outline_events(lines):
+        kind = event[0]
+        if kind == START:
+            node = OutlineNode(event[2])
+            stack[-1].add_child(node)
+            stack.append(node)
+        elif kind == BODY:
+            node = stack[-1]
+            node.content = f"{node.content}\n{event[1]}" if node.content else event[1]
+            if event[2] is not None:
+                node.evaluation = event[2]
+        elif len(stack) > 1:
+            stack.pop()
+    return root
+
+
+def iter_file_lines(filename: str, use_mmap: bool = False) -> Iterator[str]:
+    with open(filename, 'rb' if use_mmap else 'r', encoding=None if use_mmap else 'utf-8') as file:
+        if not use_mmap:
+            yield from file
+            return
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return
+        with mapped:
+            for raw_line in iter(mapped.readline, b''):
+                yield raw_line.decode('utf-8')
+
+
+def parse_file(filename: str, use_mmap: bool = False) -> OutlineNode:
+    return parse_lines(iter_file_lines(filename, use_mmap))
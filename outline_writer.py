@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+WRITE_BUFFER_SIZE = 1 << 20
+
+Record = Tuple[int, int, str, str, Optional[Dict[str, Any]]]
+
+
+def format_node_body(content: str, evaluation: Optional[Dict[str, Any]]) -> str:
+    if evaluation:
+        return f"{content}\n[EVALUATION]{json.dumps(evaluation)}\n"
+    return f"{content}\n"
+
+
+def format_node_header(level: int, title: str, content: str,
+                       evaluation: Optional[Dict[str, Any]]) -> str:
+    return f"[LEVEL {level}]{title}\n{format_node_body(content, evaluation)}"
+
+
+def format_end_tag(level: int) -> str:
+    return f"[/LEVEL {level}]\n"
+
+
+def iter_node_records(root) -> Iterator[Record]:
+    # Preorder (depth, level, title, content, evaluation) records for any tree
+    # whose nodes expose title, content, evaluation and children. Levels are
+    # written as the node's depth below the root.
+    stack = [(child, 1) for child in reversed(root.children)]
+    while stack:
+        node, depth = stack.pop()
+        yield (depth, depth, node.title, node.content, node.evaluation)
+        stack.extend((child, depth + 1) for child in reversed(node.children))
+
+
+def iter_record_chunks(records: Iterable[Record]) -> Iterator[str]:
+    open_levels: List[int] = []
+    for depth, level, title, content, evaluation in records:
+        while len(open_levels) >= depth:
+            yield format_end_tag(open_levels.pop())
+        yield format_node_header(level, title, content or "", evaluation)
+        open_levels.append(level)
+    while open_levels:
+        yield format_end_tag(open_levels.pop())
+
+
+def iter_outline_chunks(root) -> Iterator[str]:
+    return iter_record_chunks(iter_node_records(root))
+
+
+def write_atomic(filenames: List[str], chunks: Iterable[Union[str, bytes]]) -> int:
+    outputs = []
+    try:
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            fd, temp_path = tempfile.mkstemp(
+                dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix='.tmp'
+            )
+            outputs.append((os.fdopen(fd, 'wb', buffering=WRITE_BUFFER_SIZE), temp_path, path))
+
+        size = 0
+        for chunk in chunks:
+            data = chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+            size += len(data)
+            for file, _, _ in outputs:
+                file.write(data)
+
+        for file, temp_path, path in outputs:
+            file.flush()
+            os.fsync(file.fileno())
+            file.close()
+            try:
+                os.chmod(temp_path, os.stat(path).st_mode & 0o777)
+            except FileNotFoundError:
+                os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        return size
+    except BaseException:
+        for file, temp_path, _ in outputs:
+            file.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+
+
+def write_outline(root, filenames: List[str]) -> int:
+    return write_atomic(filenames, iter_outline_chunks(root))
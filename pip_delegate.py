@@ -0,0 +1,89 @@
+from typing import Any, Dict, List, Tuple
+
+from PyQt5.QtCore import QEvent, QRect, QSize, Qt
+from PyQt5.QtGui import QColor, QPainter
+from PyQt5.QtWidgets import QStyledItemDelegate, QStyleOptionViewItem, QToolTip
+
+from outline_model import EVALUATION_ROLE
+
+PIP_SIZE = 10
+PIP_SPACING = 4
+
+SCORE_COLORS = {
+    1: QColor(255, 0, 0),      # Red
+    2: QColor(255, 165, 0),    # Orange
+    3: QColor(255, 255, 0),    # Yellow
+    4: QColor(144, 238, 144),  # Light Green
+    5: QColor(0, 128, 0)       # Dark Green
+}
+
+
+def color_for_score(score: int) -> QColor:
+    return SCORE_COLORS.get(score, QColor(0, 0, 0))  # Default to black if score is invalid
+
+
+class EvaluationPipDelegate(QStyledItemDelegate):
+    # Paints one pip per criterion from the evaluation role and answers
+    # tooltips by hit-testing the same geometry, so no widgets are created.
+    def __init__(self, rubric_tooltip: str, parent=None):
+        super().__init__(parent)
+        self.rubric_tooltip = rubric_tooltip
+
+    def pips_width(self, option: QStyleOptionViewItem, evaluation: Dict[str, Any]) -> int:
+        rubric_width = option.fontMetrics.horizontalAdvance('?')
+        return len(evaluation) * (PIP_SIZE + PIP_SPACING) + rubric_width + 2 * PIP_SPACING
+
+    def pip_targets(self, option: QStyleOptionViewItem,
+                    evaluation: Dict[str, Any]) -> List[Tuple[QRect, Any, str]]:
+        rect = option.rect
+        x = rect.right() - self.pips_width(option, evaluation) + PIP_SPACING
+        y = rect.top() + (rect.height() - PIP_SIZE) // 2
+        targets = []
+        for criterion, data in evaluation.items():
+            tooltip = f"{criterion}: {data.get('comment', '')}"
+            if 'model' in data:
+                tooltip += f" ({data['model']}, tier {data.get('tier')})"
+            targets.append((QRect(x, y, PIP_SIZE, PIP_SIZE), color_for_score(data.get('score')), tooltip))
+            x += PIP_SIZE + PIP_SPACING
+        rubric_rect = QRect(x, rect.top(), option.fontMetrics.horizontalAdvance('?') + PIP_SPACING, rect.height())
+        targets.append((rubric_rect, None, self.rubric_tooltip))
+        return targets
+
+    def paint(self, painter: QPainter, option: QStyleOptionViewItem, index):
+        evaluation = index.data(EVALUATION_ROLE)
+        if not evaluation:
+            super().paint(painter, option, index)
+            return
+
+        text_option = QStyleOptionViewItem(option)
+        text_option.rect = option.rect.adjusted(0, 0, -self.pips_width(option, evaluation), 0)
+        super().paint(painter, text_option, index)
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        for rect, color, _ in self.pip_targets(option, evaluation):
+            if color is None:
+                painter.setPen(option.palette.text().color())
+                painter.drawText(rect, Qt.AlignLeft | Qt.AlignVCenter, '?')
+            else:
+                painter.setBrush(color)
+                painter.drawEllipse(rect)
+        painter.restore()
+
+    def sizeHint(self, option: QStyleOptionViewItem, index) -> QSize:
+        size = super().sizeHint(option, index)
+        evaluation = index.data(EVALUATION_ROLE)
+        if evaluation:
+            size.setWidth(size.width() + self.pips_width(option, evaluation))
+        return size
+
+    def helpEvent(self, event, view, option: QStyleOptionViewItem, index) -> bool:
+        if event.type() == QEvent.ToolTip and index.isValid():
+            evaluation = index.data(EVALUATION_ROLE)
+            if evaluation:
+                for rect, _, tooltip in self.pip_targets(option, evaluation):
+                    if rect.contains(event.pos()):
+                        QToolTip.showText(event.globalPos(), tooltip, view, rect)
+                        return True
+        return super().helpEvent(event, view, option, index)
@@ -0,0 +1,54 @@
+import re
+from typing import List
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def split_long_paragraph(paragraph: str, chunk_size: int) -> List[str]:
+    # Paragraphs longer than a whole chunk are cut at the last whitespace
+    # before the limit.
+    pieces = []
+    while len(paragraph) > chunk_size:
+        cut = paragraph.rfind(" ", 0, chunk_size)
+        if cut <= 0:
+            cut = chunk_size
+        pieces.append(paragraph[:cut].rstrip())
+        paragraph = paragraph[cut:].lstrip()
+    if paragraph:
+        pieces.append(paragraph)
+    return pieces
+
+
+def split_scene(text: str, chunk_size: int, overlap: int) -> List[str]:
+    # Packs whole paragraphs into chunks of about `chunk_size` characters.
+    # Each chunk after the first repeats trailing paragraphs of the one
+    # before it, at least `overlap` characters where the paragraphs allow
+    # and never more than half a chunk.
+    paragraphs = []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if paragraph:
+            paragraphs.extend(split_long_paragraph(paragraph, chunk_size))
+
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    size = 0
+    fresh = 0
+    for paragraph in paragraphs:
+        if fresh and size + len(paragraph) > chunk_size:
+            chunks.append(current)
+            carried: List[str] = []
+            size = 0
+            for previous in reversed(current):
+                if size >= overlap or size + len(previous) > chunk_size // 2:
+                    break
+                carried.insert(0, previous)
+                size += len(previous) + 2
+            current = carried
+            fresh = 0
+        current.append(paragraph)
+        size += len(paragraph) + 2
+        fresh += 1
+    if fresh:
+        chunks.append(current)
+    return ["\n\n".join(chunk) for chunk in chunks]
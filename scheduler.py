@@ -0,0 +1,227 @@
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from metrics import metrics
+
+# Budgets are off unless configured; AIMD on rate-limit responses keeps an
+# unconfigured run within whatever limits the account has.
+RATE_LIMIT_RPM = float(os.environ.get("EXPANSION_RATE_LIMIT_RPM", "0"))
+RATE_LIMIT_TPM = float(os.environ.get("EXPANSION_RATE_LIMIT_TPM", "0"))
+MAX_RETRIES = int(os.environ.get("EXPANSION_MAX_RETRIES", "6"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+CHARS_PER_TOKEN = 4
+
+RATE_LIMIT_STATUS = (429, 529)
+RETRY_STATUS = (408, 409, 500, 502, 503, 504) + RATE_LIMIT_STATUS
+# Error types from the response body. A streamed response reports overload
+# as an SSE error event on an HTTP 200, so the status alone misses it.
+RATE_LIMIT_ERRORS = ('rate_limit_error', 'overloaded_error')
+RETRY_ERRORS = ('api_error',) + RATE_LIMIT_ERRORS
+# How often a request queued for a concurrency slot checks for cancellation.
+CANCEL_POLL_SECONDS = 0.25
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+def pause(delay: float, cancelled: Optional[threading.Event] = None):
+    # Sleeps for `delay`, or until `cancelled` is set.
+    if cancelled is None:
+        time.sleep(delay)
+    elif cancelled.wait(delay):
+        raise RequestCancelled("Request cancelled")
+
+
+def estimate_tokens(params: Dict[str, Any]) -> int:
+    # Input tokens only, from the length of every text block in the request.
+    chars = 0
+    for block in params.get("system") or []:
+        chars += len(block.get("text", ""))
+    for message in params.get("messages") or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            for block in content or []:
+                chars += len(block.get("text", ""))
+    return chars // CHARS_PER_TOKEN + 1
+
+
+def actual_tokens(message) -> Optional[int]:
+    usage = getattr(message, 'usage', None)
+    if usage is None or getattr(usage, 'input_tokens', None) is None:
+        return None
+    return usage.input_tokens + (getattr(usage, 'cache_creation_input_tokens', None) or 0)
+
+
+def error_status(error: Exception) -> Optional[int]:
+    return getattr(error, 'status_code', None)
+
+
+def error_type(error: Exception) -> Optional[str]:
+    body = getattr(error, 'body', None)
+    if isinstance(body, dict):
+        details = body.get('error')
+        if isinstance(details, dict):
+            return details.get('type')
+        return body.get('type')
+    return None
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return error_status(error) in RATE_LIMIT_STATUS or error_type(error) in RATE_LIMIT_ERRORS
+
+
+def is_retryable(error: Exception) -> bool:
+    return (error_status(error) in RETRY_STATUS or error_type(error) in RETRY_ERRORS
+            or is_connection_error(error))
+
+
+def is_connection_error(error: Exception) -> bool:
+    try:
+        import anthropic
+    except ImportError:
+        return False
+    return isinstance(error, anthropic.APIConnectionError)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    # Refills continuously at `per_minute` units and holds at most one
+    # minute's worth. A rate of zero or less disables the limit.
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def acquire(self, amount: float, cancelled: Optional[threading.Event] = None):
+        if self.per_minute <= 0:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                delay = (amount - self.tokens) * 60 / self.per_minute
+            pause(delay, cancelled)
+
+    def adjust(self, amount: float):
+        # Settles the difference between an estimate and actual usage; the
+        # balance may go negative, which delays the next admissions.
+        if self.per_minute <= 0:
+            return
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RequestScheduler:
+    # Admits requests under the requests-per-minute and tokens-per-minute
+    # budgets and caps the number in flight. The cap grows by one per window
+    # of successes and halves on every rate-limit response (AIMD); rate
+    # limits and transient errors are retried with full-jitter backoff.
+    def __init__(self, send: Callable[[Dict[str, Any]], Any], rpm: float = RATE_LIMIT_RPM,
+                 tpm: float = RATE_LIMIT_TPM, max_concurrency: int = 4,
+                 max_retries: int = MAX_RETRIES, backoff_base: float = BACKOFF_BASE,
+                 backoff_max: float = BACKOFF_MAX):
+        self.send = send
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.active = 0
+        self.condition = threading.Condition()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def enter(self, cancelled: Optional[threading.Event] = None):
+        with self.condition:
+            while self.active >= int(self.limit):
+                if cancelled is not None and cancelled.is_set():
+                    raise RequestCancelled("Request cancelled")
+                self.condition.wait(None if cancelled is None else CANCEL_POLL_SECONDS)
+            self.active += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def leave(self, rate_limited: bool):
+        with self.condition:
+            self.active -= 1
+            if rate_limited:
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            metrics.observe('scheduler_concurrency', self.limit)
+            self.condition.notify_all()
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, retry_after(error) or 0)
+
+    def create(self, params: Dict[str, Any], send: Optional[Callable[[Dict[str, Any]], Any]] = None,
+               cancelled: Optional[threading.Event] = None):
+        # With `cancelled`, every wait (for a slot, a budget or a backoff)
+        # ends early once it is set and raises RequestCancelled; a request
+        # already sent runs to completion.
+        send = send or self.send
+        estimate = estimate_tokens(params)
+        attempt = 0
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise RequestCancelled("Request cancelled")
+            start = time.perf_counter()
+            self.enter(cancelled)
+            try:
+                self.requests.acquire(1, cancelled)
+                self.tokens.acquire(estimate, cancelled)
+            except RequestCancelled:
+                self.release()
+                raise
+            metrics.observe('scheduler_wait_seconds', time.perf_counter() - start)
+            try:
+                message = send(params)
+            except Exception as e:
+                status = error_status(e)
+                rate_limited = is_rate_limited(e)
+                self.leave(rate_limited)
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = self.backoff(attempt, e)
+                attempt += 1
+                metrics.increment('rate_limited' if rate_limited else 'retries')
+                metrics.event('retry', attempt=attempt, status=status, delay=delay, error=str(e))
+                pause(delay, cancelled)
+                continue
+            self.leave(False)
+            used = actual_tokens(message)
+            if used is not None:
+                self.tokens.adjust(used - estimate)
+            return message
@@ -0,0 +1,185 @@
+import heapq
+import re
+from bisect import bisect_left, insort
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set
+
+WORD_PATTERN = re.compile(r"\w+")
+SEARCH_RESULT_LIMIT = 200
+
+
+def tokenize(text: str) -> List[str]:
+    return WORD_PATTERN.findall(text.casefold())
+
+
+def term_set(text: str) -> FrozenSet[str]:
+    # Prose repeats most of its words, so the regex only runs over the
+    # distinct whitespace-separated chunks.
+    terms = set()
+    for chunk in set(text.casefold().split()):
+        terms.update(WORD_PATTERN.findall(chunk))
+    return frozenset(terms)
+
+
+class SearchIndex:
+    # Inverted index from lower-cased words to the nodes whose title or
+    # content contains them. Nodes are keyed by identity, so moving a node
+    # in the tree needs no update; only edited or added nodes are re-read.
+    # Every query word must match, the last one as a prefix so results
+    # follow the user's typing.
+    #
+    # A full build can run on a worker from an immutable DocNode snapshot
+    # into a separate index. Between begin_rebuild and finish_rebuild this
+    # index stays empty but remembers the nodes updated or removed, and they
+    # are re-read once the built index has been taken over.
+    def __init__(self):
+        self.postings: Dict[str, Set] = {}
+        self.title_postings: Dict[str, Set] = {}
+        self.node_terms: Dict[object, FrozenSet[str]] = {}
+        self.title_terms: Dict[object, FrozenSet[str]] = {}
+        self.order: Dict[object, int] = {}
+        self.terms: List[str] = []
+        self.sequence = 0
+        self.touched: Optional[Dict[object, None]] = None
+
+    @property
+    def building(self) -> bool:
+        return self.touched is not None
+
+    def clear(self):
+        self.postings.clear()
+        self.title_postings.clear()
+        self.node_terms.clear()
+        self.title_terms.clear()
+        self.order.clear()
+        self.terms.clear()
+        self.sequence = 0
+
+    def build(self, root):
+        self.clear()
+        for node in root.iter_nodes():
+            self.update(node)
+
+    def build_document(self, document):
+        # Indexes the live nodes of a DocNode snapshot, in document order,
+        # reading only the snapshot's fields.
+        self.clear()
+        stack = list(reversed(document.children))
+        while stack:
+            doc = stack.pop()
+            self.index_fields(doc.node, doc.title, doc.content)
+            stack.extend(reversed(doc.children))
+
+    def begin_rebuild(self):
+        self.clear()
+        self.touched = {}
+
+    def finish_rebuild(self, built: 'SearchIndex', is_live: Callable[[object], bool]):
+        touched, self.touched = self.touched or {}, None
+        self.postings = built.postings
+        self.title_postings = built.title_postings
+        self.node_terms = built.node_terms
+        self.title_terms = built.title_terms
+        self.order = built.order
+        self.terms = built.terms
+        self.sequence = built.sequence
+        for node in touched:
+            if is_live(node):
+                self.update(node)
+            else:
+                self.remove(node)
+
+    def update(self, node):
+        if self.touched is not None:
+            self.touched[node] = None
+        self.index_fields(node, node.title, node.content)
+
+    def index_fields(self, node, title: str, content: str):
+        title_terms = term_set(title or "")
+        terms = title_terms | term_set(content or "")
+        old_terms = self.node_terms.get(node, frozenset())
+        for term in old_terms - terms:
+            self.discard_posting(term, node)
+        for term in terms - old_terms:
+            nodes = self.postings.get(term)
+            if nodes is None:
+                nodes = self.postings[term] = set()
+                insort(self.terms, term)
+            nodes.add(node)
+        old_title_terms = self.title_terms.get(node, frozenset())
+        for term in old_title_terms - title_terms:
+            self.discard_title_posting(term, node)
+        for term in title_terms - old_title_terms:
+            self.title_postings.setdefault(term, set()).add(node)
+        self.node_terms[node] = terms
+        self.title_terms[node] = title_terms
+        if node not in self.order:
+            self.order[node] = self.sequence
+            self.sequence += 1
+
+    def remove(self, node):
+        if self.touched is not None:
+            self.touched[node] = None
+        for term in self.node_terms.pop(node, frozenset()):
+            self.discard_posting(term, node)
+        for term in self.title_terms.pop(node, frozenset()):
+            self.discard_title_posting(term, node)
+        self.order.pop(node, None)
+
+    def discard_posting(self, term: str, node):
+        nodes = self.postings[term]
+        nodes.discard(node)
+        if not nodes:
+            del self.postings[term]
+            del self.terms[bisect_left(self.terms, term)]
+
+    def discard_title_posting(self, term: str, node):
+        nodes = self.title_postings[term]
+        nodes.discard(node)
+        if not nodes:
+            del self.title_postings[term]
+
+    def prefix_terms(self, prefix: str) -> Iterable[str]:
+        position = bisect_left(self.terms, prefix)
+        while position < len(self.terms) and self.terms[position].startswith(prefix):
+            yield self.terms[position]
+            position += 1
+
+    def search(self, query: str, limit: int = SEARCH_RESULT_LIMIT) -> List:
+        words = tokenize(query)
+        if not words:
+            return []
+        prefix = words.pop()
+
+        exact = []
+        for word in words:
+            nodes = self.postings.get(word)
+            if not nodes:
+                return []
+            exact.append(nodes)
+        exact.sort(key=len)
+
+        matches = set(exact[0]) if exact else None
+        for nodes in exact[1:]:
+            matches &= nodes
+            if not matches:
+                return []
+
+        prefixed: Set = set()
+        titled: Set = set()
+        for term in self.prefix_terms(prefix):
+            nodes = self.postings[term]
+            prefixed.update(nodes if matches is None else nodes & matches)
+            titled.update(self.title_postings.get(term, ()))
+        if not prefixed:
+            return []
+
+        # Nodes matching every word in their title come first, then the
+        # rest; each group in document order.
+        for word in words:
+            titled &= self.title_postings.get(word, set())
+        titled &= prefixed
+        order = self.order.get
+        results = heapq.nsmallest(limit, titled, key=order)
+        if len(results) < limit:
+            results.extend(heapq.nsmallest(limit - len(results), prefixed - titled, key=order))
+        return results
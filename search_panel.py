@@ -0,0 +1,86 @@
+import time
+
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtWidgets import QLabel, QLineEdit, QListWidget, QListWidgetItem, QVBoxLayout, QWidget
+
+from metrics import metrics
+from search_index import SearchIndex, tokenize
+
+MIN_QUERY_LENGTH = 2
+SNIPPET_CHARS = 60
+
+
+def snippet(content: str, query: str) -> str:
+    words = tokenize(query)
+    text = " ".join((content or "").split())
+    position = text.casefold().find(words[-1]) if words else -1
+    if position < 0:
+        return text[:SNIPPET_CHARS]
+    start = max(0, position - SNIPPET_CHARS // 3)
+    prefix = "..." if start else ""
+    return prefix + text[start:start + SNIPPET_CHARS]
+
+
+class SearchPanel(QWidget):
+    node_activated = pyqtSignal(object)
+
+    def __init__(self, index: SearchIndex, parent=None):
+        super().__init__(parent)
+        self.index = index
+
+        self.query_edit = QLineEdit()
+        self.query_edit.setPlaceholderText('Search titles and scenes...')
+        self.query_edit.setClearButtonEnabled(True)
+        self.query_edit.textChanged.connect(self.run_query)
+        self.query_edit.returnPressed.connect(self.activate_first)
+
+        self.results = QListWidget()
+        self.results.itemActivated.connect(self.item_activated)
+        self.results.itemClicked.connect(self.item_activated)
+        self.results.hide()
+
+        self.status = QLabel()
+        self.status.hide()
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.query_edit)
+        layout.addWidget(self.status)
+        layout.addWidget(self.results)
+        self.setLayout(layout)
+
+    def run_query(self, query: str):
+        self.results.clear()
+        if len(query.strip()) < MIN_QUERY_LENGTH:
+            self.results.hide()
+            self.status.hide()
+            return
+
+        if self.index.building:
+            self.status.setText("Indexing outline...")
+            self.status.show()
+            self.results.hide()
+            return
+
+        start = time.perf_counter()
+        nodes = self.index.search(query)
+        seconds = time.perf_counter() - start
+        metrics.observe('search_seconds', seconds)
+
+        for node in nodes:
+            item = QListWidgetItem(f"{node.title}\n{snippet(node.content, query)}")
+            item.setData(Qt.UserRole, node)
+            self.results.addItem(item)
+        self.status.setText(f"{len(nodes)} matches ({seconds * 1000:.1f} ms)")
+        self.status.show()
+        self.results.setVisible(bool(nodes))
+
+    def refresh(self):
+        self.run_query(self.query_edit.text())
+
+    def activate_first(self):
+        if self.results.count():
+            self.item_activated(self.results.item(0))
+
+    def item_activated(self, item: QListWidgetItem):
+        self.node_activated.emit(item.data(Qt.UserRole))
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from weakref import WeakKeyDictionary
+
+from outline_writer import Record, iter_record_chunks, write_atomic
+
+
+class SnapshotStore:
+    # Each node is stored once as a content-addressed object holding its own
+    # fields plus the hashes of its children, so an edit only adds objects for
+    # the changed node and its ancestors. A snapshot is a tiny manifest that
+    # names the root object.
+    def __init__(self, directory: str, keep_last: int = 50, keep_daily: int = 30):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, 'objects')
+        self.manifests_dir = os.path.join(directory, 'manifests')
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.known_objects: Optional[Set[str]] = None
+        # (depth, digest, node count) of every DocNode stored so far, for as
+        # long as the snapshot is alive.
+        self.stored: 'WeakKeyDictionary[Any, Tuple[int, str, int]]' = WeakKeyDictionary()
+        # Set once retention drops a manifest; until then no object can have
+        # become unreachable and compacting skips the walk.
+        self.garbage = False
+        self.bytes_written = 0
+        self.node_count = 0
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def load_known_objects(self) -> Set[str]:
+        if self.known_objects is None:
+            self.known_objects = set()
+            for prefix in os.listdir(self.objects_dir):
+                prefix_dir = os.path.join(self.objects_dir, prefix)
+                if os.path.isdir(prefix_dir):
+                    self.known_objects.update(
+                        prefix + name for name in os.listdir(prefix_dir) if not name.endswith('.tmp')
+                    )
+        return self.known_objects
+
+    def put_object(self, data: Dict[str, Any]) -> str:
+        encoded = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(encoded).hexdigest()
+        known = self.load_known_objects()
+        if digest not in known:
+            path = self.object_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                file.write(encoded)
+            os.replace(temp_path, path)
+            known.add(digest)
+            self.bytes_written += len(encoded)
+        return digest
+
+    def get_object(self, digest: str) -> Dict[str, Any]:
+        with open(self.object_path(digest), 'rb') as file:
+            return json.loads(file.read())
+
+    def store_tree(self, records: Iterable[Record]) -> str:
+        # Builds the Merkle tree bottom-up from preorder records; each stack
+        # entry is a node waiting for its children to be hashed.
+        stack = [{'k': []}]
+        node_count = 0
+
+        def finish():
+            data = stack.pop()
+            stack[-1]['k'].append(self.put_object(data))
+
+        for depth, level, title, content, evaluation in records:
+            while len(stack) > depth:
+                finish()
+            stack.append({'l': level, 't': title, 'c': content or "", 'e': evaluation, 'k': []})
+            node_count += 1
+        while len(stack) > 1:
+            finish()
+        self.node_count = node_count
+        return self.put_object(stack[0])
+
+    def store_document(self, document) -> str:
+        # Stores a DocNode snapshot as the same objects store_tree would.
+        # A subtree shared with an earlier stored snapshot at the same depth
+        # is named by its remembered digest, so the work done per save
+        # follows the path that changed rather than the size of the outline.
+        known = self.load_known_objects()
+
+        def store(doc, depth: int) -> Tuple[str, int]:
+            remembered = self.stored.get(doc)
+            if remembered is not None and remembered[0] == depth and remembered[1] in known:
+                return remembered[1], remembered[2]
+            children, count = [], 0
+            for child in doc.children:
+                digest, child_count = store(child, depth + 1)
+                children.append(digest)
+                count += child_count
+            if depth:
+                data = {'l': depth, 't': doc.title, 'c': doc.content or "", 'e': doc.evaluation, 'k': children}
+                count += 1
+            else:
+                data = {'k': children}
+            digest = self.put_object(data)
+            self.stored[doc] = (depth, digest, count)
+            return digest, count
+
+        root, self.node_count = store(document, 0)
+        return root
+
+    def create_snapshot(self, records: Iterable[Record]) -> Optional[str]:
+        self.bytes_written = 0
+        return self.add_manifest(self.store_tree(records))
+
+    def create_document_snapshot(self, document) -> Optional[str]:
+        self.bytes_written = 0
+        return self.add_manifest(self.store_document(document))
+
+    def add_manifest(self, root: str) -> Optional[str]:
+        snapshots = self.list_snapshots()
+        if snapshots and snapshots[-1]['root'] == root:
+            return None
+
+        created = datetime.now()
+        snapshot_id = created.strftime("%Y%m%d_%H%M%S_%f")
+        manifest = {
+            'id': snapshot_id,
+            'created': created.isoformat(),
+            'root': root,
+            'nodes': self.node_count,
+            'bytes_written': self.bytes_written
+        }
+        write_atomic([os.path.join(self.manifests_dir, f"{snapshot_id}.json")], [json.dumps(manifest)])
+        self.apply_retention()
+        return snapshot_id
+
+    def list_snapshots(self) -> List[Dict[str, Any]]:
+        snapshots = []
+        for name in sorted(os.listdir(self.manifests_dir)):
+            if name.endswith('.json'):
+                with open(os.path.join(self.manifests_dir, name), 'r', encoding='utf-8') as file:
+                    snapshots.append(json.load(file))
+        return snapshots
+
+    def iter_snapshot_records(self, snapshot_id: str) -> Iterator[Record]:
+        with open(os.path.join(self.manifests_dir, f"{snapshot_id}.json"), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        root = self.get_object(manifest['root'])
+        stack = [(digest, 1) for digest in reversed(root['k'])]
+        while stack:
+            digest, depth = stack.pop()
+            data = self.get_object(digest)
+            yield (depth, data['l'], data['t'], data['c'], data['e'])
+            stack.extend((child, depth + 1) for child in reversed(data['k']))
+
+    def restore(self, snapshot_id: str, filename: str) -> int:
+        return write_atomic([filename], iter_record_chunks(self.iter_snapshot_records(snapshot_id)))
+
+    def apply_retention(self) -> List[str]:
+        snapshots = self.list_snapshots()
+        keep = {snapshot['id'] for snapshot in snapshots[-self.keep_last:]} if self.keep_last else set()
+        days = []
+        for snapshot in reversed(snapshots):
+            day = snapshot['id'][:8]
+            if day not in days:
+                days.append(day)
+                if len(days) > self.keep_daily:
+                    break
+                keep.add(snapshot['id'])
+
+        removed = []
+        for snapshot in snapshots:
+            if snapshot['id'] not in keep:
+                os.remove(os.path.join(self.manifests_dir, f"{snapshot['id']}.json"))
+                removed.append(snapshot['id'])
+        self.garbage = self.garbage or bool(removed)
+        return removed
+
+    def collect_garbage(self) -> int:
+        # A missing or unreadable object is skipped: the snapshots that
+        # reach it are already broken, and the rest can still be collected.
+        reachable = set()
+        stack = [snapshot['root'] for snapshot in self.list_snapshots()]
+        while stack:
+            digest = stack.pop()
+            if digest not in reachable:
+                reachable.add(digest)
+                try:
+                    stack.extend(self.get_object(digest)['k'])
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Skipping unreadable snapshot object {digest}: {e}")
+
+        removed = 0
+        for digest in list(self.load_known_objects()):
+            if digest not in reachable:
+                try:
+                    os.remove(self.object_path(digest))
+                except FileNotFoundError:
+                    pass
+                else:
+                    removed += 1
+                self.known_objects.discard(digest)
+        return removed
+
+    def compact(self) -> int:
+        self.apply_retention()
+        if not self.garbage:
+            return 0
+        removed = self.collect_garbage()
+        self.garbage = False
+        return removed
@@ -0,0 +1,124 @@
+import os
+import random
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from document import History, snapshot
+from outline_model import OutlineModel
+from outline_parser import OutlineNode, parse_lines
+from outline_writer import iter_outline_chunks
+
+
+def build_outline():
+    return parse_lines([
+        "[LEVEL 1]Story",
+        "[LEVEL 2]Part A", "Part A text.", "[LEVEL 3]Scene A1", "First scene.", "[/LEVEL 3]", "[/LEVEL 2]",
+        "[LEVEL 2]Part B", "Part B text.", "[/LEVEL 2]",
+        "[LEVEL 2]Part C", "Part C text.", "[/LEVEL 2]",
+        "[/LEVEL 1]",
+    ])
+
+
+def titles(node):
+    return [child.title for child in node.children]
+
+
+@pytest.fixture
+def history():
+    root = build_outline()
+    history = History()
+    history.reset(root)
+    return root, history
+
+
+def test_undo_and_redo_restore_the_live_nodes(history):
+    root, history = history
+    story = root.children[0]
+    part_a = story.children[0]
+    part_a.content = "Rewritten."
+    assert history.commit(root)
+    added = OutlineNode("Part D")
+    story.add_child(added)
+    assert history.commit(root)
+    assert not history.commit(root)
+
+    history.undo(root)
+    assert titles(story) == ["Part A", "Part B", "Part C"]
+    assert story.children[0] is part_a and part_a.content == "Rewritten."
+    history.undo(root)
+    assert part_a.content == "Part A text."
+
+    history.redo(root)
+    history.redo(root)
+    assert story.children[-1] is added and added.parent is story
+    assert part_a.content == "Rewritten."
+    assert snapshot(root) is history.current
+
+
+def test_undo_reports_dropped_nodes_and_unlinks_them(history):
+    root, history = history
+    story = root.children[0]
+    added = OutlineNode("Part D")
+    story.add_child(added)
+    scene = OutlineNode("Scene D1")
+    added.add_child(scene)
+
+    restored, detached = history.undo(root)
+    assert story in restored
+    assert added in detached and scene in detached
+    assert added.parent is None
+
+
+def test_model_ignores_nodes_dropped_by_undo(history):
+    root, history = history
+    model = OutlineModel(root)
+    story = root.children[0]
+    added = OutlineNode("Part D")
+    story.add_child(added)
+    scene = OutlineNode("Scene D1")
+    added.add_child(scene)
+    model.index_for_node(scene)
+    model.rebuild(lambda: history.undo(root))
+
+    # A worker finishing an evaluation of a node undone away mid-run.
+    for node in (added, scene):
+        assert not model.index_for_node(node).isValid()
+        model.set_partial_criterion(node, 'Dialogue', {'score': 3, 'comment': ''})
+        model.clear_partial_evaluation(node)
+        model.set_evaluation(node, None)
+
+
+def random_edit(rng, root):
+    nodes = list(root.iter_nodes())
+    node = rng.choice(nodes)
+    action = rng.randrange(4)
+    if action == 0:
+        node.content = f"Edited {rng.random()}"
+    elif action == 1:
+        node.title = f"Retitled {rng.randrange(100)}"
+    elif action == 2:
+        node.add_child(OutlineNode(f"Added {rng.randrange(100)}"))
+    elif node.parent is not root:
+        node.parent.take_child(node.row())
+
+
+def test_random_edits_undo_and_redo_to_the_same_text():
+    rng = random.Random(7)
+    root = build_outline()
+    history = History()
+    history.reset(root)
+    texts = ["".join(iter_outline_chunks(root))]
+    for _ in range(60):
+        random_edit(rng, root)
+        if history.commit(root):
+            texts.append("".join(iter_outline_chunks(root)))
+
+    for expected in reversed(texts[:-1]):
+        history.undo(root)
+        assert "".join(iter_outline_chunks(root)) == expected
+        assert all(child.parent is node for node in [root, *root.iter_nodes()] for child in node.children)
+    for expected in texts[1:]:
+        history.redo(root)
+        assert "".join(iter_outline_chunks(root)) == expected
@@ -0,0 +1,60 @@
+import json
+
+from evaluation import EVALUATION_CRITERIA, parse_evaluation
+from json_stream import MemberStreamParser
+
+
+def parse_members(chunks):
+    members = []
+    parser = MemberStreamParser(lambda key, value: members.append((key, value)))
+    for chunk in chunks:
+        parser.feed(chunk)
+    return members
+
+
+def evaluation_text(score=4):
+    return json.dumps({criterion: {"score": score, "comment": f"{criterion} comment."}
+                       for criterion in EVALUATION_CRITERIA}, indent=2)
+
+
+def test_members_arrive_as_each_value_closes():
+    text = evaluation_text()
+    members = parse_members(text[i:i + 7] for i in range(0, len(text), 7))
+    assert [key for key, _ in members] == list(EVALUATION_CRITERIA)
+    assert all(value['score'] == 4 for _, value in members)
+
+
+def test_member_is_not_emitted_before_its_object_closes():
+    members = parse_members(['{"Dialogue": {"score": 3, "comment": "Half'])
+    assert members == []
+
+
+def test_text_around_the_object_is_ignored():
+    members = parse_members(['Here you go:\n```json\n{"Dialogue": {"score": 2, "comment": "Flat."}}\n```'])
+    assert members == [("Dialogue", {"score": 2, "comment": "Flat."})]
+
+
+def test_unescaped_quotes_inside_a_comment_are_repaired():
+    text = '{"Dialogue": {"score": 3, "comment": "She says "no" twice, then "fine"."}}'
+    members = parse_members([text])
+    assert members == [("Dialogue", {"score": 3, "comment": 'She says "no" twice, then "fine".'})]
+
+
+def test_malformed_member_is_dropped_without_losing_its_neighbours():
+    text = ('{"Dialogue": {"score": 3, "comment": "Good."}, '
+            '"Pacing": {"score": 4 "comment": "Missing comma."}, '
+            '"Hooks_and_Transitions": {"score": 5, "comment": "Strong."}}')
+    members = parse_members([text])
+    assert [key for key, _ in members] == ["Dialogue", "Hooks_and_Transitions"]
+
+
+def test_parse_evaluation_salvages_valid_criteria_from_broken_json():
+    text = evaluation_text()[:-1].replace('"Dialogue comment."', '"Says "hi"."')
+    evaluation = parse_evaluation(text)
+    assert "error" not in evaluation
+    assert sorted(evaluation) == sorted(EVALUATION_CRITERIA)
+    assert evaluation["Dialogue"]["comment"] == 'Says "hi".'
+
+
+def test_parse_evaluation_reports_an_error_when_nothing_is_usable():
+    assert "error" in parse_evaluation("Sorry, I can't evaluate this scene.")
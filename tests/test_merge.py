@@ -0,0 +1,135 @@
+import os
+import random
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from document import align_children, snapshot
+from outline_model import OutlineModel
+from outline_parser import OutlineNode, parse_lines
+from outline_writer import iter_outline_chunks
+
+EVALUATION = {"Dialogue": {"score": 4, "comment": "Lively."}}
+
+
+def outline_lines(parts):
+    lines = ["[LEVEL 1]Story"]
+    for title, scenes in parts:
+        lines += [f"[LEVEL 2]{title}", f"{title} text."]
+        for scene in scenes:
+            lines += [f"[LEVEL 3]{scene}", f"{scene} text.", "[/LEVEL 3]"]
+        lines.append("[/LEVEL 2]")
+    lines.append("[/LEVEL 1]")
+    return lines
+
+
+PARTS = [("Part A", ["Scene A1", "Scene A2"]), ("Part B", ["Scene B1"]), ("Part C", []), ("Part D", ["Scene D1"])]
+
+
+def text(root):
+    return "".join(iter_outline_chunks(root))
+
+
+def titles(nodes):
+    return [node.title for node in nodes]
+
+
+def parse_parts(parts):
+    # Scenes carry an evaluation, as they would in a saved outline.
+    root = parse_lines(outline_lines(parts))
+    for node in root.iter_nodes():
+        if node.title.startswith("Scene"):
+            node.evaluation = dict(EVALUATION)
+    return root
+
+
+def live_model():
+    root = parse_parts(PARTS)
+    return OutlineModel(root), snapshot(root)
+
+
+def test_align_children_pairs_equal_titles_in_place():
+    root = parse_lines(outline_lines(PARTS))
+    docs = snapshot(root).children[0].children
+    pairs = align_children(docs, parse_lines(outline_lines(PARTS)).children[0].children)
+    assert [(doc.title, node.title, moved) for doc, node, moved in pairs] == [
+        (title, title, False) for title, _ in PARTS
+    ]
+
+
+def test_align_children_reports_reordered_siblings_as_moves():
+    docs = snapshot(parse_lines(outline_lines(PARTS))).children[0].children
+    theirs = parse_lines(outline_lines([PARTS[3], PARTS[1], PARTS[2], PARTS[0]])).children[0].children
+    pairs = align_children(docs, theirs)
+    assert all(doc is not None and node is not None for doc, node, _ in pairs)
+    assert [doc.title == node.title for doc, node, _ in pairs] == [True] * 4
+    assert titles(node for _, node, _ in pairs) == ["Part D", "Part B", "Part C", "Part A"]
+    assert any(moved for _, _, moved in pairs)
+
+
+def test_align_children_patches_a_retitled_node_in_place():
+    docs = snapshot(parse_lines(outline_lines(PARTS))).children[0].children
+    renamed = [("Part B (revised)", ["Scene B1"]) if title == "Part B" else (title, scenes) for title, scenes in PARTS]
+    theirs = parse_lines(outline_lines(renamed)).children[0].children
+    pairs = align_children(docs, theirs)
+    assert [(doc.title, node.title) for doc, node, _ in pairs][1] == ("Part B", "Part B (revised)")
+    assert all(doc is not None and node is not None for doc, node, _ in pairs)
+
+
+def test_merge_moves_reordered_parts_and_keeps_their_nodes():
+    model, base = live_model()
+    story = model.root.children[0]
+    before = {node.title: node for node in model.root.iter_nodes()}
+    theirs = parse_parts([PARTS[1], PARTS[0], PARTS[3], PARTS[2]])
+
+    changed, detached = model.merge(base, theirs)
+    assert text(model.root) == text(theirs)
+    assert titles(story.children) == ["Part B", "Part A", "Part D", "Part C"]
+    assert detached == [] and changed == []
+    for node in model.root.iter_nodes():
+        assert before[node.title] is node
+        assert node.evaluation == (EVALUATION if node.title.startswith("Scene") else None)
+
+
+def test_merge_applies_edits_additions_and_removals():
+    model, base = live_model()
+    lines = outline_lines([("Part A", ["Scene A1"]), ("Part B", ["Scene B1", "Scene B2"]), PARTS[2], PARTS[3]])
+    lines[lines.index("Scene B1 text.")] = "Scene B1 rewritten."
+    theirs = parse_lines(lines)
+    for node in theirs.iter_nodes():
+        if node.title in ("Scene A1", "Scene D1"):
+            node.evaluation = dict(EVALUATION)
+
+    changed, detached = model.merge(base, theirs)
+    assert titles(model.root.children[0].children[1].children) == ["Scene B1", "Scene B2"]
+    assert model.root.children[0].children[1].children[0].content == "Scene B1 rewritten."
+    assert titles(detached) == ["Scene A2"]
+    assert {"Scene B1", "Scene B2"} <= set(titles(changed))
+
+
+def test_merge_does_not_bring_back_a_node_deleted_locally():
+    model, base = live_model()
+    story = model.root.children[0]
+    model.remove_node(story.children[2])
+    theirs = parse_parts([PARTS[0], PARTS[1], ("Part C", ["Scene C1"]), PARTS[3]])
+
+    model.merge(base, theirs)
+    assert titles(story.children) == ["Part A", "Part B", "Part D"]
+
+
+def test_merge_of_random_reorders_matches_the_file():
+    rng = random.Random(3)
+    for _ in range(30):
+        model, base = live_model()
+        parts = [(title, rng.sample(scenes, len(scenes))) for title, scenes in PARTS]
+        rng.shuffle(parts)
+        if rng.random() < 0.5:
+            parts.pop(rng.randrange(len(parts)))
+        theirs = parse_parts(parts)
+        before = {node.title: node for node in model.root.iter_nodes()}
+        _, detached = model.merge(base, theirs)
+        assert text(model.root) == text(theirs)
+        kept = {title for title, _ in parts}
+        removed = [[title, *scenes] for title, scenes in PARTS if title not in kept]
+        assert sorted(titles(detached)) == sorted(sum(removed, []))
+        assert all(before[node.title] is node for node in model.root.iter_nodes())
+        assert all(child.parent is node for node in [model.root, *model.root.iter_nodes()] for child in node.children)
@@ -0,0 +1,99 @@
+import json
+import threading
+
+import pytest
+
+import evaluation
+from batch_stub_server import BatchStubServer
+from evaluation import SceneEvaluator, collect_scene_jobs
+from message_batches import BatchEvaluator, job_path
+from metrics import metrics
+from outline_parser import parse_lines
+
+SCENE_TEXT = "The river ran on under the bridge. " * 20
+
+
+def build_outline():
+    lines = ["[LEVEL 1]Story"]
+    for part in range(2):
+        lines += [f"[LEVEL 2]Part {part}", "[LEVEL 3]Chapter", "[LEVEL 4]Sequence"]
+        for scene in range(2):
+            lines += [f"[LEVEL 5]Scene {part}.{scene}", f"{SCENE_TEXT} Part {part}, scene {scene}.", "[/LEVEL 5]"]
+        lines += ["[/LEVEL 4]", "[/LEVEL 3]", "[/LEVEL 2]"]
+    lines.append("[/LEVEL 1]")
+    return parse_lines(lines)
+
+
+@pytest.fixture
+def stub(monkeypatch, tmp_path):
+    server = BatchStubServer().start()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('ANTHROPIC_BASE_URL', server.url)
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test-key')
+    monkeypatch.setattr(evaluation, 'batch_client', None)
+    monkeypatch.setattr(metrics, 'events_file', None)
+    yield server
+    server.stop()
+
+
+def make_batch_evaluator(tmp_path, root):
+    evaluator = SceneEvaluator(cache_file=None)
+    evaluator.story_context = evaluation.build_story_outline(root)
+    return BatchEvaluator(evaluator, state_file=str(tmp_path / 'batch.json'), poll_interval=0.01)
+
+
+def test_submit_poll_resume(stub, tmp_path):
+    root = build_outline()
+    batches = make_batch_evaluator(tmp_path, root)
+    jobs = collect_scene_jobs(root)
+    assert len(jobs) == 4
+
+    # Cancelled after the first poll: nothing is yielded and the batch is kept.
+    cancelled = threading.Event()
+    cancelled.set()
+    assert list(batches.evaluate_jobs(jobs, cancelled)) == []
+    state = json.loads((tmp_path / 'batch.json').read_text())
+    assert state['batch_id'] == stub.created[0]
+    assert batches.state_paths(state) == {job_path(node) for node, _ in jobs}
+
+    # A title edit changes the story outline; the resumed results still map
+    # back to their scenes and no new batch is sent.
+    root.children[0].children[1].title = "Renamed Part"
+    batches.evaluator.story_context = evaluation.build_story_outline(root)
+    results = list(batches.evaluate_jobs(collect_scene_jobs(root), submit=False))
+
+    assert stub.created == [state['batch_id']]
+    assert not (tmp_path / 'batch.json').exists()
+    assert {node for node, _, _ in results} == {node for node, _ in jobs}
+    for _, result, error in results:
+        assert error is None
+        assert result['Dialogue']['score'] == 4
+        assert result['Dialogue']['tier'] == 1
+
+
+def test_edited_scene_is_not_matched_on_resume(stub, tmp_path):
+    root = build_outline()
+    batches = make_batch_evaluator(tmp_path, root)
+    jobs = collect_scene_jobs(root)
+    cancelled = threading.Event()
+    cancelled.set()
+    list(batches.evaluate_jobs(jobs, cancelled))
+
+    edited = jobs[0][0]
+    edited.content = SCENE_TEXT + " Rewritten."
+    results = list(batches.evaluate_jobs(collect_scene_jobs(root), submit=False))
+
+    assert edited not in {node for node, _, _ in results}
+    assert len(results) == 3
+
+
+def test_missing_batch_clears_state(stub, tmp_path):
+    root = build_outline()
+    batches = make_batch_evaluator(tmp_path, root)
+    (tmp_path / 'batch.json').write_text(json.dumps(
+        {'batch_id': 'msgbatch_missing', 'story_context': '', 'requests': {}}
+    ))
+
+    assert list(batches.evaluate_jobs(collect_scene_jobs(root), submit=False)) == []
+    assert not (tmp_path / 'batch.json').exists()
+    assert stub.created == []
@@ -0,0 +1,73 @@
+import pytest
+
+from outline_index import OutlineIndex, write_indexed_outline
+from outline_parser import parse_file, parse_lines
+from outline_writer import iter_outline_chunks
+
+EVALUATION = {"Dialogue": {"score": 3, "comment": "Fine."}}
+
+
+def build_outline():
+    lines = ["[LEVEL 1]Story"]
+    for part in range(2):
+        lines += [f"[LEVEL 2]Part {part}", f"Part {part} summary."]
+        for scene in range(3):
+            lines += [f"[LEVEL 3]Scene {part}.{scene}", f"Scene {part}.{scene} text.", "[/LEVEL 3]"]
+        lines.append("[/LEVEL 2]")
+    lines.append("[/LEVEL 1]")
+    return parse_lines(lines)
+
+
+@pytest.fixture
+def outline(tmp_path):
+    filename = str(tmp_path / "outline.txt")
+    root = build_outline()
+    write_indexed_outline(root, filename)
+    return filename, root
+
+
+def test_written_index_matches_a_rebuilt_one(outline):
+    filename, _ = outline
+    written = OutlineIndex(filename).ensure()
+    rebuilt = OutlineIndex(filename)
+    rebuilt.build()
+    assert [entry.to_json() for entry in written.entries] == [entry.to_json() for entry in rebuilt.entries]
+
+
+def test_read_node_by_path(outline):
+    filename, _ = outline
+    index = OutlineIndex(filename)
+    assert index.read_node("0/1/2") == ("Scene 1.2", "Scene 1.2 text.", None)
+    with pytest.raises(KeyError):
+        index.read_node("0/5")
+
+
+@pytest.mark.parametrize("content", ["Scene 0.1 text!", "A much longer rewrite of the scene.\nOver two lines.", "S"])
+def test_patch_shifts_the_offsets_of_later_nodes(outline, content):
+    filename, root = outline
+    index = OutlineIndex(filename)
+    index.patch_content("0/0/1", content)
+    index.patch_evaluation("0/0/2", EVALUATION)
+
+    root.node_at((0, 0, 1)).content = content
+    root.node_at((0, 0, 2)).evaluation = EVALUATION
+    with open(filename, encoding="utf-8") as file:
+        assert file.read() == "".join(iter_outline_chunks(root))
+    for path in ("0", "0/0/2", "0/1", "0/1/2"):
+        title, _, _ = index.read_node(path)
+        assert title == root.node_at(tuple(int(row) for row in path.split("/"))).title
+    assert index.read_node("0/0/2")[2] == EVALUATION
+    assert parse_file(filename).node_at((0, 1, 2)).content == "Scene 1.2 text."
+
+    fresh = OutlineIndex(filename)
+    fresh.build()
+    assert [entry.to_json() for entry in index.entries] == [entry.to_json() for entry in fresh.entries]
+
+
+def test_index_is_rebuilt_after_the_file_changes(outline):
+    filename, root = outline
+    index = OutlineIndex(filename).ensure()
+    root.node_at((0, 1)).title = "Part One"
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("".join(iter_outline_chunks(root)) + "\n")
+    assert index.read_node("0/1")[0] == "Part One"
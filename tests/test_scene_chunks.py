@@ -0,0 +1,54 @@
+from scene_chunks import split_scene
+
+PARAGRAPHS = [(f"Paragraph {number}. " + "The lamps were lit one by one along the quay. " * 4).strip()
+              for number in range(30)]
+SCENE = "\n\n".join(PARAGRAPHS)
+
+
+def test_short_scene_is_a_single_chunk():
+    assert split_scene("One paragraph.\n\nAnother.", 1000, 100) == ["One paragraph.\n\nAnother."]
+
+
+def test_chunks_keep_whole_paragraphs_within_the_size():
+    chunks = split_scene(SCENE, 1200, 200)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= 1200
+        assert all(paragraph in PARAGRAPHS for paragraph in chunk.split("\n\n"))
+
+
+def test_every_paragraph_is_covered_in_order():
+    chunks = split_scene(SCENE, 1200, 200)
+    seen = []
+    for chunk in chunks:
+        for paragraph in chunk.split("\n\n"):
+            if paragraph not in seen:
+                seen.append(paragraph)
+    assert seen == PARAGRAPHS
+
+
+def carried(previous, chunk):
+    earlier = previous.split("\n\n")
+    return [paragraph for paragraph in chunk.split("\n\n") if paragraph in earlier]
+
+
+def test_each_chunk_repeats_the_end_of_the_one_before():
+    chunks = split_scene(SCENE, 1200, 200)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        repeated = carried(previous, chunk)
+        assert repeated and previous.endswith("\n\n".join(repeated))
+        assert chunk.startswith("\n\n".join(repeated))
+        assert sum(len(paragraph) + 2 for paragraph in repeated) >= 200
+
+
+def test_overlap_never_exceeds_half_a_chunk():
+    chunks = split_scene(SCENE, 1200, 5000)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert sum(len(paragraph) + 2 for paragraph in carried(previous, chunk)) <= 600 + 2
+
+
+def test_paragraph_longer_than_a_chunk_is_cut_at_whitespace():
+    words = " ".join(f"word{number}" for number in range(400))
+    chunks = split_scene(words, 500, 0)
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert " ".join(chunks).split() == words.split()
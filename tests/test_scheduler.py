@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+from metrics import metrics
+from scheduler import RequestCancelled, RequestScheduler, TokenBucket
+
+
+class RateLimited(Exception):
+    status_code = 429
+    body = {'type': 'error', 'error': {'type': 'rate_limit_error', 'message': 'Rate limited'}}
+
+
+@pytest.fixture(autouse=True)
+def no_event_log(monkeypatch):
+    monkeypatch.setattr(metrics, 'events_file', None)
+
+
+def cancel_after(seconds):
+    cancelled = threading.Event()
+    threading.Timer(seconds, cancelled.set).start()
+    return cancelled
+
+
+def rate_limited(params):
+    raise RateLimited("Rate limited")
+
+
+def test_cancel_cuts_backoff_short_and_frees_the_slot():
+    scheduler = RequestScheduler(rate_limited, 0, 0, 2, max_retries=6, backoff_base=30, backoff_max=60)
+    start = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        scheduler.create({'messages': []}, cancelled=cancel_after(0.2))
+    assert time.monotonic() - start < 5
+    assert scheduler.active == 0
+
+
+def test_cancel_cuts_budget_wait_short():
+    bucket = TokenBucket(1)
+    bucket.acquire(1)
+    start = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        bucket.acquire(1, cancel_after(0.2))
+    assert time.monotonic() - start < 5
+
+
+def test_cancelled_request_is_not_sent():
+    sent = []
+    scheduler = RequestScheduler(sent.append, 0, 0, 1)
+    cancelled = threading.Event()
+    cancelled.set()
+    with pytest.raises(RequestCancelled):
+        scheduler.create({'messages': []}, cancelled=cancelled)
+    assert sent == []
+
+
+def test_retryable_error_is_retried_until_it_succeeds():
+    attempts = []
+
+    def flaky(params):
+        attempts.append(params)
+        if len(attempts) < 3:
+            raise RateLimited("Rate limited")
+        return 'message'
+
+    scheduler = RequestScheduler(flaky, 0, 0, 4, backoff_base=0.01, backoff_max=0.01)
+    assert scheduler.create({'messages': []}) == 'message'
+    assert len(attempts) == 3
+    assert scheduler.limit < 4
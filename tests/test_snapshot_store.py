@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from document import snapshot
+from outline_parser import parse_file, parse_lines
+from outline_writer import iter_node_records, iter_outline_chunks
+from snapshot_store import SnapshotStore
+
+
+def build_outline():
+    lines = ["[LEVEL 1]Story"]
+    for chapter in range(3):
+        lines += [f"[LEVEL 2]Chapter {chapter}"]
+        for scene in range(3):
+            lines += [f"[LEVEL 3]Scene {chapter}.{scene}", f"Scene {chapter}.{scene} text.", "[/LEVEL 3]"]
+        lines.append("[/LEVEL 2]")
+    lines.append("[/LEVEL 1]")
+    return parse_lines(lines)
+
+
+def text(root):
+    return "".join(iter_outline_chunks(root))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SnapshotStore(str(tmp_path / "snapshots"), keep_last=2, keep_daily=1)
+
+
+def edit_and_snapshot(store, root, count):
+    ids, texts = [], []
+    for number in range(count):
+        root.node_at((0, 1, 2)).content = f"Revision {number}"
+        ids.append(store.create_document_snapshot(snapshot(root)))
+        texts.append(text(root))
+    return ids, texts
+
+
+def test_unchanged_tree_creates_no_snapshot(store):
+    root = build_outline()
+    assert store.create_snapshot(iter_node_records(root)) is not None
+    assert store.create_document_snapshot(snapshot(root)) is None
+    assert len(store.list_snapshots()) == 1
+
+
+def test_document_and_record_snapshots_store_the_same_objects(store):
+    root = build_outline()
+    assert store.store_tree(iter_node_records(root)) == store.store_document(snapshot(root))
+    root.node_at((0, 2, 0)).content = "Changed."
+    store.store_document(snapshot(root))
+    before = store.bytes_written
+    assert store.store_tree(iter_node_records(root)) == store.store_document(snapshot(root))
+    assert store.bytes_written == before
+
+
+def test_an_edit_only_writes_the_path_to_the_changed_node(store):
+    root = build_outline()
+    store.create_document_snapshot(snapshot(root))
+    root.node_at((0, 1, 2)).content = "Edited."
+    store.create_document_snapshot(snapshot(root))
+    assert store.node_count == 13
+    objects = [store.get_object(digest) for digest in store.load_known_objects()]
+    assert sum(1 for data in objects if data.get('c') == "Edited.") == 1
+    # The scene, its chapter, the story and the root.
+    assert len(objects) == 14 + 4
+
+
+def test_retention_keeps_the_latest_snapshots_and_restores_them(store, tmp_path):
+    root = build_outline()
+    ids, texts = edit_and_snapshot(store, root, 5)
+    assert [snapshot['id'] for snapshot in store.list_snapshots()] == ids[-2:]
+
+    for snapshot_id, expected in zip(ids[-2:], texts[-2:]):
+        target = str(tmp_path / f"{snapshot_id}.txt")
+        store.restore(snapshot_id, target)
+        assert text(parse_file(target)) == expected
+
+
+def test_compact_collects_objects_only_reachable_from_dropped_snapshots(store):
+    root = build_outline()
+    edit_and_snapshot(store, root, 5)
+    assert store.garbage
+    removed = store.compact()
+    assert removed > 0 and not store.garbage
+    reachable = set()
+    stack = [snapshot['root'] for snapshot in store.list_snapshots()]
+    while stack:
+        digest = stack.pop()
+        reachable.add(digest)
+        stack.extend(store.get_object(digest)['k'])
+    assert store.load_known_objects() == reachable
+    assert store.compact() == 0
+
+
+def test_compact_skips_missing_objects(store):
+    root = build_outline()
+    edit_and_snapshot(store, root, 4)
+    latest = store.list_snapshots()[-1]
+    os.remove(store.object_path(latest['root']))
+    assert store.compact() > 0